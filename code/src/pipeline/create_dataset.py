@@ -2,13 +2,17 @@
 import sys
 sys.path.append('..')
 
+import os
 import json
 import tensorflow as tf
 
 from transformers import AutoTokenizer
 
 from utils import load_data
+from utils import shm_queue
+from utils import aspell_cache
 from utils import introduce_errors
+from utils import token_shards
 
 from multiprocessing import Process, Manager
 
@@ -26,6 +30,9 @@ def main(config_filename: str):
     # data from file
     ERRORS_FROM_FILE = False
     REVERTED_PIPELINE = False
+    # transport of examples between data loading processes and tf.data
+    SHARED_MEMORY_QUEUE = config.get('shared_memory_queue', False)
+    TOKENIZE_BATCH_SIZE = config.get('tokenize_batch_size', 1)
 
     # model
     TOKENIZER = config['tokenizer']
@@ -37,8 +44,20 @@ def main(config_filename: str):
     CHAR_ERR_DISTRIBUTION = config['char_err_distribution']
     TOKEN_ERR_PROB = config['token_err_prob']   
     CHAR_ERR_PROB = config['char_err_prob']
+    # aspell suggestions cache
+    ASPELL_CACHE_SIZE = config.get('aspell_cache_size', 0)
+    ASPELL_SUGGESTIONS_FILE = config.get('aspell_suggestions_file', None)
+    ASPELL_CACHE_WARM_SIZE = config.get('aspell_cache_warm_size', 50_000)
 
     DATASET_FILEPATH = config['dataset_filepath']
+    # output format: "tsv" (lines "correct\toriginal" in DATASET_FILEPATH) or "shards" (pre-tokenized shards in directory DATASET_FILEPATH)
+    DATASET_FORMAT = config.get('dataset_format', 'tsv')
+    SHARD_SIZE = config.get('shard_size', token_shards.DEFAULT_SHARD_SIZE)
+    SHARD_STORE_TEXT = config.get('shard_store_text', True)
+    # fast creation without tf.data (load_data.create_error_data), it stops after NUM_LINES lines
+    NUM_LINES = config.get('num_lines', None)
+    CREATE_BATCH_SIZE = config.get('create_batch_size', 1024)
+    REPORT_INTERVAL = config.get('report_interval', 30)
 
     ### Init 
     tf.random.set_seed(SEED)
@@ -48,9 +67,28 @@ def main(config_filename: str):
     # bucket_batch_sizes = [bucket_batch_size * num_div for bucket_batch_size in BUCKET_BATCH_SIZES_PER_GPU]
     ###
 
+    # table of suggestions for the most frequent tokens, it is shared by all data loading processes
+    if not ERRORS_FROM_FILE:
+        aspell_cache.ensure_warm_table(ASPELL_SUGGESTIONS_FILE, LANG, TOKEN_FILE, ASPELL_CACHE_WARM_SIZE)
+
+    if NUM_LINES:
+        gel = load_data.GenereteErrorLine(
+            tokens, characters, LANG, 
+            TOKEN_ERR_DISTRIBUTION, CHAR_ERR_DISTRIBUTION, 
+            TOKEN_ERR_PROB, CHAR_ERR_PROB)
+        print("Generating...")
+        load_data.create_error_data(
+            DATA_PATHS, DATASET_FILEPATH, NUM_LINES, NUM_PARALLEL, gel, LANG, DATASET_FORMAT, tokenizer, MAX_LENGTH,
+            CREATE_BATCH_SIZE, ASPELL_CACHE_SIZE, ASPELL_SUGGESTIONS_FILE, SEED, SHARD_SIZE, SHARD_STORE_TEXT, REPORT_INTERVAL)
+        return
+
     ### Dataset loading:
-    manager = Manager()
-    queue = manager.Queue(4 * NUM_PARALLEL)
+    # shared memory of SharedMemoryQueue is released at exit of this process (see shm_queue)
+    if SHARED_MEMORY_QUEUE:
+        queue = shm_queue.SharedMemoryQueue(4 * NUM_PARALLEL, MAX_LENGTH)
+    else:
+        manager = Manager()
+        queue = manager.Queue(4 * NUM_PARALLEL)
     if not ERRORS_FROM_FILE:
         gel = load_data.GenereteErrorLine(
             tokens, characters, LANG, 
@@ -62,7 +100,8 @@ def main(config_filename: str):
     # main process that creates pool, goes over possible files and manage other read processes
     process = Process(
                 target=load_data.data_generator, 
-                args=(queue, DATA_PATHS, NUM_PARALLEL, gel, tokenizer, MAX_LENGTH, ERRORS_FROM_FILE, REVERTED_PIPELINE, ))
+                args=(queue, DATA_PATHS, NUM_PARALLEL, gel, tokenizer, MAX_LENGTH, ERRORS_FROM_FILE, REVERTED_PIPELINE, None, LANG,
+                      TOKENIZE_BATCH_SIZE, ASPELL_CACHE_SIZE, ASPELL_SUGGESTIONS_FILE, ))
 
     process.start()
 
@@ -84,8 +123,22 @@ def main(config_filename: str):
                 })
     
     print("Generating...")
-    for i, batch in enumerate(dataset):
-        with open(DATASET_FILEPATH, "a+") as file:
+    if DATASET_FORMAT == 'shards':
+        # every complete shard can be used for training, the last one is incomplete until generating stops
+        writer = token_shards.ShardWriter(DATASET_FILEPATH, "shard", SHARD_SIZE, SHARD_STORE_TEXT, 
+                                          metadata={"tokenizer": TOKENIZER, "max_length": MAX_LENGTH})
+        # dataset never ends, the last shard is finalized when generating is stopped (e.g. by KeyboardInterrupt)
+        try:
+            for i, batch in enumerate(dataset):
+                writer.write(
+                    batch['input_ids'].numpy(), batch['tokenized_target_line'].numpy(),
+                    batch['original_sentence'].numpy().decode("utf-8"), batch['correct_sentence'].numpy().decode("utf-8"))
+        finally:
+            writer.close()
+        return
+
+    with open(DATASET_FILEPATH, "a+") as file:
+        for i, batch in enumerate(dataset):
             correct_sentence = batch['correct_sentence'].numpy().decode("utf-8")
             original_sentence = batch['original_sentence'].numpy().decode("utf-8")
 
@@ -15,7 +15,7 @@ from m2scorer.m2scorer import load_annotation
 from tensorflow.keras import mixed_precision
 
 from utils import dataset_utils
-from utils.udpipe_tokenizer.udpipe_tokenizer import UDPipeTokenizer
+from utils.udpipe_tokenizer.udpipe_pool import UDPipeTokenizerPool
 
 from utils.time_check import timeout
 
@@ -58,6 +58,9 @@ def main(config_filename: str):
     VERY_VERBOSE = config['very_verbose']
     
     MAX_EVAL_LENGTH = config['max_eval_length']
+    # udpipe tokenization of predictions
+    UDPIPE_NUM_PROCESSES = config.get('udpipe_num_processes', 4)
+    UDPIPE_BATCH_SIZE = config.get('udpipe_batch_size', 256)
 
     TIMEOUT = config['timeout']
 
@@ -65,6 +68,9 @@ def main(config_filename: str):
     # OUTPUT_DIR = 'akces-results' # "m2_data": "../../data/akces-gec/dev/dev.all.m2",
     OUTPUT_DIR = 'akces-test'
     
+    # processes of udpipe tokenizer are forked before TensorFlow initializes GPUs
+    udpipe_tokenizer = UDPipeTokenizerPool("cs", UDPIPE_NUM_PROCESSES, UDPIPE_BATCH_SIZE, first_sentence_only=True)
+
     tf.random.set_seed(SEED)
     
     tokenizer = AutoTokenizer.from_pretrained(TOKENIZER)
@@ -91,8 +97,6 @@ def main(config_filename: str):
     dataset = dataset.padded_batch(BATCH_SIZE, padded_shapes={'input_ids': [None], 'attention_mask': [None]})
     dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
 
-    udpipe_tokenizer = UDPipeTokenizer("cs")
-
     @timeout(TIMEOUT)
     def compute_metrics(tokenized_predicted_sentences, dev_source_sentences, dev_gold_edits):
         total_stat_correct, total_stat_proposed, total_stat_gold = 0, 0, 0 
@@ -192,14 +196,8 @@ def main(config_filename: str):
     print("End of generating...")
 
     print("Udpipe tokenization...")
-    tokenized_predicted_sentences = []
-
-    for i, line in enumerate(predicted_sentences):
-        if i % BATCH_SIZE == 0:
-            print(f"Tokenize {i+BATCH_SIZE} sentences.")
-        tokenization = udpipe_tokenizer.tokenize(line)
-        sentence = " ".join([token.string for token in tokenization[0]]) if len(tokenization) > 0 else ""
-        tokenized_predicted_sentences.append(sentence)
+    tokenized_predicted_sentences = udpipe_tokenizer.tokenize(predicted_sentences)
+    udpipe_tokenizer.close()
 
     print("End of tokenization...")
 
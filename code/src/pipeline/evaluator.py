@@ -2,7 +2,6 @@ import sys
 sys.path.append('..')
 
 import os
-import time
 import shutil
 import tensorflow as tf
 
@@ -11,13 +10,16 @@ from transformers import AutoTokenizer
 from transformers import AutoConfig
 import json
 
-from m2scorer.levenshtein import batch_multi_pre_rec_f1_part
 from m2scorer.m2scorer import load_annotation
 
 from tensorflow.keras import mixed_precision
 
 from utils import dataset_utils
-from utils.udpipe_tokenizer.udpipe_tokenizer import UDPipeTokenizer
+from utils import eval_cache
+from utils import m2_scoring
+from utils import xla_generation
+from utils import checkpoint_watcher
+from utils.udpipe_tokenizer.udpipe_pool import UDPipeTokenizerPool
 
 from utils.time_check import timeout
 
@@ -37,7 +39,13 @@ def main(config_filename: str):
     M2_DATA_DEV = config['m2_data_dev']
     M2_DATA_TEST = config['m2_data_test']
     OTHER_DATASETS = config.get('other_datasets', [])
+    # generate all datasets together (one load of weights, every unique source sentence is generated once)
+    MULTI_DATASET_EVAL = config.get('multi_dataset_eval', False)
     BATCH_SIZE = config['batch_size']
+    # batches for generation by number of tokens (sentences sorted by length), otherwise BATCH_SIZE sentences in file order
+    EVAL_MAX_TOKENS = config.get('eval_max_tokens', None)
+    # cache of parsed M2 files and tokenized source sentences (keyed by file hash and tokenizer)
+    EVAL_CACHE_DIR = config.get('eval_cache_dir', None)
     
     # model
     MODEL = config['model']
@@ -48,6 +56,8 @@ def main(config_filename: str):
     
     # logs
     MODEL_CHECKPOINT_PATH = config['model_checkpoint_path']
+    # ledger of evaluated checkpoints (default is in MODEL_CHECKPOINT_PATH)
+    CHECKPOINT_LEDGER_FILE = config.get('checkpoint_ledger_file', None)
 
     # evaluation
     MAX_UNCHANGED_WORDS = config['max_unchanged_words']
@@ -57,6 +67,19 @@ def main(config_filename: str):
     VERY_VERBOSE = config['very_verbose']
     
     MAX_EVAL_LENGTH = config['max_eval_length']
+    # XLA-compiled generation with inputs padded to length buckets
+    XLA_GENERATE = config.get('xla_generate', False)
+    XLA_BUCKETS = config.get('xla_buckets', None)
+    # max length of output by bucket (factor * bucket + offset), it is faster but it can truncate long outputs (off by default)
+    XLA_MAX_LENGTH_FACTOR = config.get('xla_max_length_factor', None)
+    XLA_MAX_LENGTH_OFFSET = config.get('xla_max_length_offset', 16)
+    # udpipe tokenization of predictions
+    UDPIPE_NUM_PROCESSES = config.get('udpipe_num_processes', 4)
+    UDPIPE_BATCH_SIZE = config.get('udpipe_batch_size', 256)
+    # processes of M2 scorer
+    M2_NUM_PROCESSES = config.get('m2_num_processes', 4)
+    # persistent cache of M2 counts shared by all checkpoints
+    M2_CACHE_FILE = config.get('m2_cache_file', None)
 
     # TIMEOUT = config['timeout'] # it cat be useful for geccc
 
@@ -73,6 +96,11 @@ def main(config_filename: str):
         BEST_CKPT_NAME = best_ckpt['name']
         BEST_CKPT_F1 = best_ckpt['f1']
 
+    # processes of udpipe tokenizer and M2 scorer are forked before TensorFlow initializes GPUs
+    udpipe_tokenizer = UDPipeTokenizerPool("cs", UDPIPE_NUM_PROCESSES, UDPIPE_BATCH_SIZE, first_sentence_only=False)
+    m2_scorer = m2_scoring.M2Scorer(BATCH_SIZE, MAX_UNCHANGED_WORDS, BETA, IGNORE_WHITESPACE_CASING, VERBOSE, VERY_VERBOSE, 
+                                     M2_NUM_PROCESSES, M2_CACHE_FILE)
+
     tf.random.set_seed(SEED)
     
     tokenizer = AutoTokenizer.from_pretrained(TOKENIZER)
@@ -91,7 +119,16 @@ def main(config_filename: str):
                 'attention_mask': attention_mask[0]}
         return dato
     
-    def get_dataset_pipeline(source_sentences) -> tf.data.Dataset:
+    def get_dataset_pipeline(source_sentences, input_ids=None) -> tf.data.Dataset:
+        if EVAL_MAX_TOKENS:
+            # sorted batches, generated sentences are returned to original order by indices of batch
+            if input_ids is None:
+                input_ids = tokenizer(source_sentences, max_length=MAX_EVAL_LENGTH, truncation=True)['input_ids']
+            return dataset_utils.create_sorted_batches(input_ids, EVAL_MAX_TOKENS, tokenizer.pad_token_id)
+        if input_ids is not None:
+            # pre-tokenized sentences, batches are created only once
+            return dataset_utils.create_batches(input_ids, BATCH_SIZE, tokenizer.pad_token_id)
+
         dataset = tf.data.Dataset.from_tensor_slices((source_sentences))
         dataset = dataset.map(tokenize_line, num_parallel_calls=tf.data.experimental.AUTOTUNE)
         dataset = dataset.map(dataset_utils.split_features_and_labels, num_parallel_calls=tf.data.experimental.AUTOTUNE)
@@ -99,16 +136,47 @@ def main(config_filename: str):
         dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
         return dataset
     
-    dev_source_sentences, dev_gold_edits = load_annotation(M2_DATA_DEV)
-    test_source_sentences, test_gold_edits = load_annotation(M2_DATA_TEST)
+    eval_input_cache = eval_cache.EvalInputCache(EVAL_CACHE_DIR, tokenizer, TOKENIZER, MAX_EVAL_LENGTH) if EVAL_CACHE_DIR else None
+
+    def load_dataset(m2_file):
+        # returns source sentences, gold edits and input_ids (None without cache, sentences are tokenized by pipeline)
+        if eval_input_cache is not None:
+            return eval_input_cache.load(m2_file)
+        source_sentences, gold_edits = load_annotation(m2_file)
+        return source_sentences, gold_edits, None
+
+    dev_source_sentences, dev_gold_edits, dev_input_ids = load_dataset(M2_DATA_DEV)
+    test_source_sentences, test_gold_edits, test_input_ids = load_dataset(M2_DATA_TEST)
     
     datasets = []
     for dataset in OTHER_DATASETS:
-        source_sentences, gold_edits = load_annotation(dataset)
-        datasets.append((source_sentences, gold_edits, dataset))
+        source_sentences, gold_edits, input_ids = load_dataset(dataset)
+        datasets.append((source_sentences, gold_edits, dataset, input_ids))
 
-    dev_dataset = get_dataset_pipeline(dev_source_sentences)
-    test_dataset = get_dataset_pipeline(test_source_sentences)
+    if MULTI_DATASET_EVAL:
+        # all datasets are generated together, every unique source sentence is generated only once
+        eval_datasets = [
+            (dev_source_sentences, dev_gold_edits, OUTPUT_DIR_DEV, FILE_DEV_PREDICTIONS),
+            (test_source_sentences, test_gold_edits, OUTPUT_DIR_TEST, FILE_TEST_PREDICTIONS),
+        ]
+        for source_sentences, gold_edits, dataset_path, _ in datasets:
+            name = os.path.splitext(os.path.basename(dataset_path))[0]
+            eval_datasets.append((source_sentences, gold_edits, name, name + "_prediction.txt"))
+        unique_sentences = list(dict.fromkeys(sentence for source_sentences, _, _, _ in eval_datasets for sentence in source_sentences))
+        unique_indices = {sentence: i for i, sentence in enumerate(unique_sentences)}
+        print(f"Unique sentences: {len(unique_sentences)}/{sum(len(source_sentences) for source_sentences, _, _, _ in eval_datasets)}")
+        unique_input_ids = None
+        if eval_input_cache is not None:
+            sentence_input_ids = {}
+            for source_sentences, input_ids in [(dev_source_sentences, dev_input_ids), (test_source_sentences, test_input_ids)] + [
+                    (source_sentences, input_ids) for source_sentences, _, _, input_ids in datasets]:
+                sentence_input_ids.update(zip(source_sentences, input_ids))
+            unique_input_ids = [sentence_input_ids[sentence] for sentence in unique_sentences]
+        unique_dataset = get_dataset_pipeline(unique_sentences, unique_input_ids)
+    else:
+        dev_dataset = get_dataset_pipeline(dev_source_sentences, dev_input_ids)
+        test_dataset = get_dataset_pipeline(test_source_sentences, test_input_ids)
+        other_datasets = [get_dataset_pipeline(source_sentences, input_ids) for source_sentences, _, _, input_ids in datasets]
     ###
     
     ### Prepare right model:
@@ -131,8 +199,11 @@ def main(config_filename: str):
         model.model.decoder.embed_scale = tf.cast(model.model.decoder.embed_scale, tf.float16)
     ###
 
-    # prepare udpipe tokenizer
-    udpipe_tokenizer = UDPipeTokenizer("cs")
+    if XLA_GENERATE:
+        # compiled functions use variables of model, so they are valid for all loaded checkpoints
+        generator = xla_generation.BucketedGenerator(
+            model, tokenizer.pad_token_id, MAX_EVAL_LENGTH, XLA_BUCKETS, XLA_MAX_LENGTH_FACTOR, XLA_MAX_LENGTH_OFFSET,
+            min_length=min_length, num_beams=num_beams, length_penalty=length_penalty)
 
     # @timeout(TIMEOUT)
     def compute_metrics(tokenized_predicted_sentences, source_sentences, dev_gold_edits):
@@ -140,70 +211,45 @@ def main(config_filename: str):
         Goes through predicted sentences and computes true positives (stat_correct), 
         TP+FN (stat_gold), TP+FP (stat_proposed) for every batch.
         Finally it computes precision, recall and f1. 
+        Batches are scored in parallel by m2_scorer.
         '''
-        total_stat_correct, total_stat_proposed, total_stat_gold = 0, 0, 0 
-        size = BATCH_SIZE
-        for i in range(0, len(tokenized_predicted_sentences), size):
-            ### possible print
-            # print("Batch of sentences:")
-            # for s in tokenized_predicted_sentences[i:i+size]:
-            #     print(s)
-            # print("End of batch")
-            ###
-
-            # batch_multi_pre_rec_f1_part is created by petr pechman in fork from M2scorer
-            # (https://github.com/petrpechman/m2scorer/blob/cbf794b370be2fc77f98ee9531cf33001572b7ce/m2scorer/levenshtein.py#L866),
-            # it is almost same as batch_multi_pre_rec_f1
-            stat_correct, stat_proposed, stat_gold = batch_multi_pre_rec_f1_part(
-                tokenized_predicted_sentences[i:i+size], 
-                source_sentences[i:i+size], 
-                dev_gold_edits[i:i+size],
-                MAX_UNCHANGED_WORDS, BETA, IGNORE_WHITESPACE_CASING, VERBOSE, VERY_VERBOSE)
-            total_stat_correct += stat_correct
-            total_stat_proposed += stat_proposed
-            total_stat_gold += stat_gold
-            p  = total_stat_correct / total_stat_proposed if total_stat_proposed > 0 else 0
-            r  = total_stat_correct / total_stat_gold if total_stat_gold > 0 else 0
-            f1 = (1.0+BETA*BETA) * p * r / (BETA*BETA*p+r) if (p+r) > 0 else 0
-            print(f"Step {i+1}")
-            print("Precision:\t", p)
-            print("Recall:\t", r)
-            print("F1:\t", f1)
-        return total_stat_correct, total_stat_proposed, total_stat_gold
+        return m2_scorer.score(tokenized_predicted_sentences, source_sentences, dev_gold_edits)
     
-    def generate_and_score(unevaluated_checkpoint, dataset, source_sentences, gold_edits, output_dir, predictions_file) -> float:
-        step = int(unevaluated_checkpoint[5:])
-        result_dir = os.path.join(MODEL_CHECKPOINT_PATH, output_dir)
-        predictions_filepath = os.path.join(MODEL_CHECKPOINT_PATH, str(step) + "-" + predictions_file)
-
-        ### Load model weights for evaluation
-        model.load_weights(os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint + "/")).expect_partial()
-        ###
-
+    def generate(dataset, num_sentences: int):
         print("Generating...")
-        predicted_sentences = []
+        predicted_sentences = [None] * num_sentences
+        position = 0
         for i, batch in enumerate(dataset):
             print(f"Generate {i+1}. batch.") 
-            preds = model.generate(
-                batch['input_ids'], 
-                max_length=MAX_EVAL_LENGTH,
-                min_length=min_length,
-                num_beams=num_beams,
-                length_penalty=length_penalty,
-                )
+            if XLA_GENERATE:
+                preds = generator.generate(batch['input_ids'], batch['attention_mask'])
+            else:
+                preds = model.generate(
+                    batch['input_ids'], 
+                    attention_mask=batch['attention_mask'],
+                    max_length=MAX_EVAL_LENGTH,
+                    min_length=min_length,
+                    num_beams=num_beams,
+                    length_penalty=length_penalty,
+                    )
             batch_sentences = tokenizer.batch_decode(preds, skip_special_tokens=True)
-            predicted_sentences = predicted_sentences + batch_sentences
+            # sorted batches have indices of sentences, otherwise sentences go in order
+            indices = batch['indices'] if 'indices' in batch else range(position, position + len(batch_sentences))
+            for index, sentence in zip(indices, batch_sentences):
+                predicted_sentences[index] = sentence
+            position += len(batch_sentences)
         print("End of generating...")
+        return predicted_sentences
 
+    def tokenize(predicted_sentences):
         print("Udpipe tokenization...")
-        tokenized_predicted_sentences = []
-        for i, line in enumerate(predicted_sentences):
-            if i % BATCH_SIZE == 0:
-                print(f"Tokenize {i+BATCH_SIZE} sentences.")
-            tokenization = udpipe_tokenizer.tokenize(line)
-            sentence = " ".join([token.string for tokens_of_part in tokenization for token in tokens_of_part]) if len(tokenization) > 0 else ""
-            tokenized_predicted_sentences.append(sentence)
+        tokenized_predicted_sentences = udpipe_tokenizer.tokenize(predicted_sentences)
         print("End of tokenization...")
+        return tokenized_predicted_sentences
+
+    def score(step, tokenized_predicted_sentences, source_sentences, gold_edits, output_dir, predictions_file) -> float:
+        result_dir = os.path.join(MODEL_CHECKPOINT_PATH, output_dir)
+        predictions_filepath = os.path.join(MODEL_CHECKPOINT_PATH, str(step) + "-" + predictions_file)
 
         print("Compute metrics...")
         total_stat_correct, total_stat_proposed, total_stat_gold = compute_metrics(tokenized_predicted_sentences, source_sentences, gold_edits)
@@ -229,41 +275,78 @@ def main(config_filename: str):
 
         return f1
 
-    while True:
-        if os.path.isdir(MODEL_CHECKPOINT_PATH):
-            unevaluated = [f for f in os.listdir(MODEL_CHECKPOINT_PATH) if f.startswith('ckpt')]
-            unevaluated = sorted(unevaluated)
+    def load_weights(unevaluated_checkpoint):
+        ### Load model weights for evaluation
+        model.load_weights(os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint + "/")).expect_partial()
+        ###
+
+    def generate_and_score(unevaluated_checkpoint, dataset, source_sentences, gold_edits, output_dir, predictions_file) -> float:
+        step = int(unevaluated_checkpoint[5:])
+        load_weights(unevaluated_checkpoint)
+        tokenized_predicted_sentences = tokenize(generate(dataset, len(source_sentences)))
+        return score(step, tokenized_predicted_sentences, source_sentences, gold_edits, output_dir, predictions_file)
+
+    def generate_and_score_all(unevaluated_checkpoint):
+        '''
+        Loads weights once, generates every unique source sentence of all datasets once
+        and scores every dataset by its part of predictions. Returns f1 of all eval_datasets.
+        '''
+        step = int(unevaluated_checkpoint[5:])
+        load_weights(unevaluated_checkpoint)
+        tokenized_unique_sentences = tokenize(generate(unique_dataset, len(unique_sentences)))
+
+        f1s = []
+        for source_sentences, gold_edits, output_dir, predictions_file in eval_datasets:
+            tokenized_predicted_sentences = [tokenized_unique_sentences[unique_indices[sentence]] for sentence in source_sentences]
+            f1s.append(score(step, tokenized_predicted_sentences, source_sentences, gold_edits, output_dir, predictions_file))
+        return f1s
+
+    # checkpoints are evaluated in order of epochs as soon as they are written, evaluated checkpoints are stored in ledger
+    watcher = checkpoint_watcher.CheckpointWatcher(MODEL_CHECKPOINT_PATH, CHECKPOINT_LEDGER_FILE)
+
+    def evaluate_checkpoint(unevaluated_checkpoint):
+        nonlocal BEST_CKPT_NAME, BEST_CKPT_F1
+        try:
+            if MULTI_DATASET_EVAL:
+                f1_dev, f1_test = generate_and_score_all(unevaluated_checkpoint)[:2]
+            else:
+                f1_dev = generate_and_score(unevaluated_checkpoint, dev_dataset, dev_source_sentences, dev_gold_edits, OUTPUT_DIR_DEV,
+                                   FILE_DEV_PREDICTIONS)
+                f1_test = generate_and_score(unevaluated_checkpoint, test_dataset, test_source_sentences, test_gold_edits, OUTPUT_DIR_TEST,
+                                   FILE_TEST_PREDICTIONS)
+                
+                for i, (dataset_zip, dataset) in enumerate(zip(datasets, other_datasets)):
+                    source_sentences, gold_edits, dataset_path, _ = dataset_zip
+                    output_dir = os.path.splitext(os.path.basename(dataset_path))[0]
+                    file_predictions = os.path.splitext(os.path.basename(dataset_path))[0] + "_prediction.txt"
+                    f1 = generate_and_score(unevaluated_checkpoint, dataset, source_sentences, gold_edits, output_dir, file_predictions)
+            
+            if BEST_CKPT_FILENAME and f1_test > BEST_CKPT_F1:
+                BEST_CKPT_NAME = unevaluated_checkpoint
+                BEST_CKPT_F1 = f1_test
             
-            for unevaluated_checkpoint in unevaluated:
-                try:
-                    f1_dev = generate_and_score(unevaluated_checkpoint, dev_dataset, dev_source_sentences, dev_gold_edits, OUTPUT_DIR_DEV,
-                                       FILE_DEV_PREDICTIONS)
-                    f1_test = generate_and_score(unevaluated_checkpoint, test_dataset, test_source_sentences, test_gold_edits, OUTPUT_DIR_TEST,
-                                       FILE_TEST_PREDICTIONS)
-                    
-                    for i, dataset_zip in enumerate(datasets):
-                        source_sentences, gold_edits, dataset_path = dataset_zip
-                        dataset = get_dataset_pipeline(source_sentences)
-                        output_dir = os.path.splitext(os.path.basename(dataset_path))[0]
-                        file_predictions = os.path.splitext(os.path.basename(dataset_path))[0] + "_prediction.txt"
-                        f1 = generate_and_score(unevaluated_checkpoint, dataset, source_sentences, gold_edits, output_dir, file_predictions)
-                    
-                    if BEST_CKPT_FILENAME and f1_test > BEST_CKPT_F1:
-                        BEST_CKPT_NAME = unevaluated_checkpoint
-                        BEST_CKPT_F1 = f1_test
-                        
-                        json_object = json.dumps({
-                             "name": BEST_CKPT_NAME,
-                             "f1": BEST_CKPT_F1
-                        })
-
-                        with open(BEST_CKPT_FILENAME, "w") as outfile:
-                            outfile.write(json_object)
-                    else:
-                        # print("Here should be delete")
-                        print(f"Delete: {os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint)}")
-                        shutil.rmtree(os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint))
-                except Exception:
-                    print("Something went wrong... Try again...")
-
-        time.sleep(10)
+                json_object = json.dumps({
+                     "name": BEST_CKPT_NAME,
+                     "f1": BEST_CKPT_F1
+                })
+
+                with open(BEST_CKPT_FILENAME, "w") as outfile:
+                    outfile.write(json_object)
+            else:
+                # print("Here should be delete")
+                print(f"Delete: {os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint)}")
+                shutil.rmtree(os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint))
+            watcher.mark_evaluated(unevaluated_checkpoint)
+        except Exception as e:
+            print(e)
+            print("Something went wrong... Try again...")
+            watcher.mark_failed(unevaluated_checkpoint)
+
+    # processes of udpipe tokenizer and M2 scorer are stopped when evaluation is stopped
+    try:
+        for unevaluated_checkpoint in watcher.watch():
+            evaluate_checkpoint(unevaluated_checkpoint)
+    finally:
+        watcher.close()
+        udpipe_tokenizer.close()
+        m2_scorer.close()
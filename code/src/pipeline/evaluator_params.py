@@ -11,13 +11,13 @@ from transformers import AutoTokenizer
 from transformers import AutoConfig
 import json
 
-from m2scorer.levenshtein import batch_multi_pre_rec_f1_part
 from m2scorer.m2scorer import load_annotation
 
 from tensorflow.keras import mixed_precision
 
 from utils import dataset_utils
-from utils.udpipe_tokenizer.udpipe_tokenizer import UDPipeTokenizer
+from utils import m2_scoring
+from utils.udpipe_tokenizer.udpipe_pool import UDPipeTokenizerPool
 
 from utils.time_check import timeout
 
@@ -57,6 +57,13 @@ def main(config_filename: str):
     VERY_VERBOSE = config['very_verbose']
     
     MAX_EVAL_LENGTH = config['max_eval_length']
+    # udpipe tokenization of predictions
+    UDPIPE_NUM_PROCESSES = config.get('udpipe_num_processes', 4)
+    UDPIPE_BATCH_SIZE = config.get('udpipe_batch_size', 256)
+    # processes of M2 scorer
+    M2_NUM_PROCESSES = config.get('m2_num_processes', 4)
+    # persistent cache of M2 counts shared by all checkpoints
+    M2_CACHE_FILE = config.get('m2_cache_file', None)
 
     # TIMEOUT = config['timeout'] # it cat be useful for geccc
 
@@ -64,6 +71,11 @@ def main(config_filename: str):
     OUTPUT_DIR_DEV = 'results-dev' # "m2_data": "../../data/akces-gec/dev/dev.all.m2",
     OUTPUT_DIR_TEST = 'results-test' # "m2_data": "../../data/akces-gec/test/test.all.m2",
     
+    # processes of udpipe tokenizer and M2 scorer are forked before TensorFlow initializes GPUs
+    udpipe_tokenizer = UDPipeTokenizerPool("cs", UDPIPE_NUM_PROCESSES, UDPIPE_BATCH_SIZE, first_sentence_only=True)
+    m2_scorer = m2_scoring.M2Scorer(BATCH_SIZE, MAX_UNCHANGED_WORDS, BETA, IGNORE_WHITESPACE_CASING, VERBOSE, VERY_VERBOSE, 
+                                     M2_NUM_PROCESSES, M2_CACHE_FILE)
+
     tf.random.set_seed(SEED)
     
     tokenizer = AutoTokenizer.from_pretrained(TOKENIZER)
@@ -117,8 +129,6 @@ def main(config_filename: str):
         model.model.decoder.embed_scale = tf.cast(model.model.decoder.embed_scale, tf.float16)
     ###
 
-    # prepare udpipe tokenizer
-    udpipe_tokenizer = UDPipeTokenizer("cs")
 
     # @timeout(TIMEOUT)
     def compute_metrics(tokenized_predicted_sentences, source_sentences, dev_gold_edits):
@@ -126,36 +136,9 @@ def main(config_filename: str):
         Goes through predicted sentences and computes true positives (stat_correct), 
         TP+FN (stat_gold), TP+FP (stat_proposed) for every batch.
         Finally it computes precision, recall and f1. 
+        Batches are scored in parallel by m2_scorer.
         '''
-        total_stat_correct, total_stat_proposed, total_stat_gold = 0, 0, 0 
-        size = BATCH_SIZE
-        for i in range(0, len(tokenized_predicted_sentences), size):
-            ### possible print
-            # print("Batch of sentences:")
-            # for s in tokenized_predicted_sentences[i:i+size]:
-            #     print(s)
-            # print("End of batch")
-            ###
-
-            # batch_multi_pre_rec_f1_part is created by petr pechman in fork from M2scorer
-            # (https://github.com/petrpechman/m2scorer/blob/cbf794b370be2fc77f98ee9531cf33001572b7ce/m2scorer/levenshtein.py#L866),
-            # it is almost same as batch_multi_pre_rec_f1
-            stat_correct, stat_proposed, stat_gold = batch_multi_pre_rec_f1_part(
-                tokenized_predicted_sentences[i:i+size], 
-                source_sentences[i:i+size], 
-                dev_gold_edits[i:i+size],
-                MAX_UNCHANGED_WORDS, BETA, IGNORE_WHITESPACE_CASING, VERBOSE, VERY_VERBOSE)
-            total_stat_correct += stat_correct
-            total_stat_proposed += stat_proposed
-            total_stat_gold += stat_gold
-            p  = total_stat_correct / total_stat_proposed if total_stat_proposed > 0 else 0
-            r  = total_stat_correct / total_stat_gold if total_stat_gold > 0 else 0
-            f1 = (1.0+BETA*BETA) * p * r / (BETA*BETA*p+r) if (p+r) > 0 else 0
-            print(f"Step {i+1}")
-            print("Precision:\t", p)
-            print("Recall:\t", r)
-            print("F1:\t", f1)
-        return total_stat_correct, total_stat_proposed, total_stat_gold
+        return m2_scorer.score(tokenized_predicted_sentences, source_sentences, dev_gold_edits)
     
     def generate_and_score(unevaluated_checkpoint, dataset, source_sentences, gold_edits, output_dir):
         step = int(unevaluated_checkpoint[5:])
@@ -175,13 +158,7 @@ def main(config_filename: str):
         print("End of generating...")
 
         print("Udpipe tokenization...")
-        tokenized_predicted_sentences = []
-        for i, line in enumerate(predicted_sentences):
-            if i % BATCH_SIZE == 0:
-                print(f"Tokenize {i+BATCH_SIZE} sentences.")
-            tokenization = udpipe_tokenizer.tokenize(line)
-            sentence = " ".join([token.string for token in tokenization[0]]) if len(tokenization) > 0 else ""
-            tokenized_predicted_sentences.append(sentence)
+        tokenized_predicted_sentences = udpipe_tokenizer.tokenize(predicted_sentences)
         print("End of tokenization...")
 
         print("Compute metrics...")
@@ -208,18 +185,20 @@ def main(config_filename: str):
             print(text)
             tf.summary.text("predictions", text, step)
 
-    while True:
-        if os.path.isdir(MODEL_CHECKPOINT_PATH):
-            unevaluated = [f for f in os.listdir(MODEL_CHECKPOINT_PATH) if f.startswith('ckpt')]
-            
-            for unevaluated_checkpoint in unevaluated:
-                try:
-                    generate_and_score(unevaluated_checkpoint, dev_dataset, dev_source_sentences, dev_gold_edits, OUTPUT_DIR_DEV)
-                    generate_and_score(unevaluated_checkpoint, test_dataset, test_source_sentences, test_gold_edits, OUTPUT_DIR_TEST)
-                    
-                    # print(f"Delete: {os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint)}")
-                    # shutil.rmtree(os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint))
-                except:
-                    print("Something went wrong... Try again...")
-
-        time.sleep(10)
+    # processes of udpipe tokenizer and M2 scorer are stopped when evaluation is stopped
+    with udpipe_tokenizer, m2_scorer:
+        while True:
+            if os.path.isdir(MODEL_CHECKPOINT_PATH):
+                unevaluated = [f for f in os.listdir(MODEL_CHECKPOINT_PATH) if f.startswith('ckpt')]
+                
+                for unevaluated_checkpoint in unevaluated:
+                    try:
+                        generate_and_score(unevaluated_checkpoint, dev_dataset, dev_source_sentences, dev_gold_edits, OUTPUT_DIR_DEV)
+                        generate_and_score(unevaluated_checkpoint, test_dataset, test_source_sentences, test_gold_edits, OUTPUT_DIR_TEST)
+                        
+                        # print(f"Delete: {os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint)}")
+                        # shutil.rmtree(os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint))
+                    except:
+                        print("Something went wrong... Try again...")
+
+            time.sleep(10)
@@ -2,11 +2,13 @@ import sys
 sys.path.append('..')
 
 import os
-import time
 import json
+import time
 import shutil
 import tensorflow as tf
 
+from concurrent.futures import ThreadPoolExecutor
+
 from transformers import TFAutoModelForSeq2SeqLM
 from transformers import AutoTokenizer
 from transformers import AutoConfig
@@ -14,7 +16,9 @@ from transformers import AutoConfig
 from tensorflow.keras import mixed_precision
 
 from utils import dataset_utils
-from utils.udpipe_tokenizer.udpipe_tokenizer import UDPipeTokenizer
+from utils import xla_generation
+from utils import checkpoint_watcher
+from utils.udpipe_tokenizer.udpipe_pool import UDPipeTokenizerPool
 
 def main(config_filename: str):
     with open(config_filename) as json_file:
@@ -45,7 +49,21 @@ def main(config_filename: str):
     # logs
     MODEL_CHECKPOINT_PATH = config['model_checkpoint_path']
     MAX_EVAL_LENGTH = config['max_eval_length']
+    # XLA-compiled generation with inputs padded to length buckets
+    XLA_GENERATE = config.get('xla_generate', False)
+    XLA_BUCKETS = config.get('xla_buckets', None)
+    # max length of output by bucket (factor * bucket + offset), it is faster but it can truncate long outputs (off by default)
+    XLA_MAX_LENGTH_FACTOR = config.get('xla_max_length_factor', None)
+    XLA_MAX_LENGTH_OFFSET = config.get('xla_max_length_offset', 16)
+    # udpipe tokenization of predictions
+    UDPIPE_NUM_PROCESSES = config.get('udpipe_num_processes', 4)
+    UDPIPE_BATCH_SIZE = config.get('udpipe_batch_size', 256)
     FILE_PREDICTIONS = 'predictions.txt'
+    # number of batches after which predictions are flushed and progress (number of processed lines) is recorded
+    PROGRESS_INTERVAL = config.get('progress_interval', 10)
+    WRITE_BUFFER_SIZE = config.get('write_buffer_size', 8 * 1024 * 1024)
+    # ledger of checkpoints that are already used for generating
+    CHECKPOINT_LEDGER_FILE = config.get('checkpoint_ledger_file', os.path.join(MODEL_CHECKPOINT_PATH, 'generated_checkpoints.json'))
 
     MODEL_TYPE = ""
     if MODEL in ["google/mt5-small", "google/mt5-base"]:
@@ -54,6 +72,9 @@ def main(config_filename: str):
         MODEL_TYPE = "Bart-mine"
     print(MODEL_TYPE)
     
+    # processes of udpipe tokenizer are forked before TensorFlow initializes GPUs
+    udpipe_tokenizer = UDPipeTokenizerPool("cs", UDPIPE_NUM_PROCESSES, UDPIPE_BATCH_SIZE, first_sentence_only=False)
+
     tf.random.set_seed(SEED)
     
     tokenizer = AutoTokenizer.from_pretrained(TOKENIZER)
@@ -72,15 +93,15 @@ def main(config_filename: str):
                 'attention_mask': attention_mask[0]}
         return dato
     
-    def get_dataset_pipeline(data_filepath) -> tf.data.Dataset:
+    def get_dataset_pipeline(data_filepath, start_line: int = 0) -> tf.data.Dataset:
         dataset = tf.data.TextLineDataset([data_filepath], num_parallel_reads=tf.data.experimental.AUTOTUNE)
+        dataset = dataset.skip(start_line)
         dataset = dataset.map(tokenize_line, num_parallel_calls=tf.data.experimental.AUTOTUNE)
         dataset = dataset.map(dataset_utils.split_features_and_labels, num_parallel_calls=tf.data.experimental.AUTOTUNE)
         dataset = dataset.padded_batch(BATCH_SIZE, padded_shapes={'input_ids': [None], 'attention_mask': [None]})
         dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
         return dataset
 
-    dataset = get_dataset_pipeline(DATA_FILEPATH)
     ###
     
     ### Prepare right model:
@@ -103,50 +124,111 @@ def main(config_filename: str):
         model.model.decoder.embed_scale = tf.cast(model.model.decoder.embed_scale, tf.float16)
     ###
 
-    # prepare udpipe tokenizer
-    udpipe_tokenizer = UDPipeTokenizer("cs")
+    if XLA_GENERATE:
+        generator = xla_generation.BucketedGenerator(
+            model, tokenizer.pad_token_id, MAX_EVAL_LENGTH, XLA_BUCKETS, XLA_MAX_LENGTH_FACTOR, XLA_MAX_LENGTH_OFFSET,
+            min_length=min_length, num_beams=num_beams, length_penalty=length_penalty, diversity_penalty=diversity_penalty)
     
-    def generate_and_score(unevaluated_checkpoint, dataset, predictions_file):
-        step = int(unevaluated_checkpoint[5:])
-        predictions_filepath = os.path.join(MODEL_CHECKPOINT_PATH, str(step) + "-" + predictions_file)
+    def load_progress(progress_filepath):
+        # Returns number of processed input lines and size of predictions file after them (None if there is no record).
+        if not os.path.isfile(progress_filepath):
+            return None
+        with open(progress_filepath) as json_file:
+            progress = json.load(json_file)
+        return progress['lines'], progress['bytes']
 
-        ### Load model weights for evaluation
-        model.load_weights(os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint + "/")).expect_partial()
-        ###
+    def write_progress(progress_filepath, lines: int, size: int):
+        tmp_path = f"{progress_filepath}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w') as json_file:
+            json.dump({'lines': lines, 'bytes': size}, json_file)
+        os.replace(tmp_path, progress_filepath)
 
-        print("Predicting...")
+    def generate_batches(dataset):
         for i, batch in enumerate(dataset):
             print(f"Generate {i+1}. batch.") 
-            with open(predictions_filepath, "a+") as file:
+            if XLA_GENERATE:
+                preds = generator.generate(batch['input_ids'], batch['attention_mask'])
+            else:
                 preds = model.generate(
                     batch['input_ids'], 
+                    attention_mask=batch['attention_mask'],
                     max_length=MAX_EVAL_LENGTH,
                     min_length=min_length,
                     num_beams=num_beams,
                     length_penalty=length_penalty,
                     diversity_penalty=diversity_penalty,
                     )
-                batch_sentences = tokenizer.batch_decode(preds, skip_special_tokens=True)
-                print("Write into file...")
-                for i, line in enumerate(batch_sentences):
-                    tokenization = udpipe_tokenizer.tokenize(line)
-                    sentence = " ".join([token.string for tokens_of_part in tokenization for token in tokens_of_part]) if len(tokenization) > 0 else ""
-                    file.write(sentence + '\n')
+            yield tokenizer.batch_decode(preds, skip_special_tokens=True)
+
+    def generate_and_score(unevaluated_checkpoint, predictions_file):
+        '''
+        Generates predictions of all lines of DATA_FILEPATH into predictions file. Progress is recorded
+        every PROGRESS_INTERVAL batches, so generating continues after the last recorded line after crash
+        (predictions written after the last record are truncated). Udpipe tokenization of batch runs
+        in background thread together with generating of the next batch.
+        '''
+        step = int(unevaluated_checkpoint[5:])
+        predictions_filepath = os.path.join(MODEL_CHECKPOINT_PATH, str(step) + "-" + predictions_file)
+        progress_filepath = predictions_filepath + ".progress"
+
+        ### Load model weights for evaluation
+        model.load_weights(os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint + "/")).expect_partial()
+        ###
+
+        # predictions written after the last progress record are truncated; without progress record predictions are
+        # written from the start and existing predictions file (e.g. written by older version) is moved aside
+        progress = load_progress(progress_filepath)
+        if progress is not None:
+            start_line, size = progress
+            if start_line > 0:
+                print(f"Resume from line {start_line}...")
+            with open(predictions_filepath, 'ab') as file:
+                file.truncate(size)
+        else:
+            start_line = 0
+            if os.path.isfile(predictions_filepath) and os.path.getsize(predictions_filepath) > 0:
+                old_filepath = f"{predictions_filepath}.old-{int(time.time())}"
+                print(f"There is no progress record of {predictions_filepath}, existing file is moved to {old_filepath}.")
+                os.replace(predictions_filepath, old_filepath)
+        dataset = get_dataset_pipeline(DATA_FILEPATH, start_line)
+
+        def write_batch(file, tokenized_sentences):
+            print("Write into file...")
+            for sentence in tokenized_sentences:
+                file.write((sentence + '\n').encode('utf-8'))
+            return len(tokenized_sentences)
+
+        print("Predicting...")
+        lines = start_line
+        with open(predictions_filepath, "ab", buffering=WRITE_BUFFER_SIZE) as file, ThreadPoolExecutor(max_workers=1) as executor:
+            pending = None
+            for i, batch_sentences in enumerate(generate_batches(dataset)):
+                future = executor.submit(udpipe_tokenizer.tokenize, batch_sentences, False)
+                if pending is not None:
+                    lines += write_batch(file, pending.result())
+                pending = future
+                if (i + 1) % PROGRESS_INTERVAL == 0:
+                    file.flush()
+                    write_progress(progress_filepath, lines, file.tell())
+            if pending is not None:
+                lines += write_batch(file, pending.result())
+            file.flush()
+            write_progress(progress_filepath, lines, file.tell())
         print("End of predicting...")
 
-    while True:
-        if os.path.isdir(MODEL_CHECKPOINT_PATH):
-            unevaluated = [f for f in os.listdir(MODEL_CHECKPOINT_PATH) if f.startswith('ckpt')]
-            unevaluated = sorted(unevaluated)
-            
-            for unevaluated_checkpoint in unevaluated:
-                try:
-                    generate_and_score(unevaluated_checkpoint, dataset, FILE_PREDICTIONS)
-                    
-                    # print(f"Delete: {os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint)}")
-                    # shutil.rmtree(os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint))
-                except:
-                    print("Something went wrong... Try again...")
+    # checkpoints are processed in order of epochs as soon as they are written, processed checkpoints are stored in ledger,
+    # checkpoints that are being written and failed checkpoints (after retry delay) are picked up again
+    watcher = checkpoint_watcher.CheckpointWatcher(MODEL_CHECKPOINT_PATH, CHECKPOINT_LEDGER_FILE)
+    # processes of udpipe tokenizer are stopped when generating is stopped
+    with udpipe_tokenizer:
+        for unevaluated_checkpoint in watcher.watch():
+            try:
+                generate_and_score(unevaluated_checkpoint, FILE_PREDICTIONS)
+                watcher.mark_evaluated(unevaluated_checkpoint)
             
-            break        
-        time.sleep(10)
+                # print(f"Delete: {os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint)}")
+                # shutil.rmtree(os.path.join(MODEL_CHECKPOINT_PATH, unevaluated_checkpoint))
+            except Exception as e:
+                print(e)
+                print("Something went wrong... Try again...")
+                watcher.mark_failed(unevaluated_checkpoint)
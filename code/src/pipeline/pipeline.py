@@ -13,6 +13,8 @@ from transformers import TFAutoModelForSeq2SeqLM
 from tensorflow.keras import mixed_precision
 
 from utils import load_data
+from utils import shm_queue
+from utils import aspell_cache
 from utils import dataset_utils
 from utils import introduce_errors
 from utils import create_errors
@@ -42,6 +44,13 @@ def main(config_filename: str):
     # data from file
     ERRORS_FROM_FILE = config.get('errors_from_file', False)
     REVERTED_PIPELINE = config.get('reverted_pipeline', False)
+    # transport of examples between data loading processes and tf.data
+    SHARED_MEMORY_QUEUE = config.get('shared_memory_queue', False)
+    TOKENIZE_BATCH_SIZE = config.get('tokenize_batch_size', 1)
+    # pre-tokenized shards (created by create_dataset with "dataset_format": "shards"), they replace data loading processes
+    SHARDS_DIR = config.get('shards_dir', None)
+    # resume position is computed from epoch of restored backup, shards_start_example only overrides it
+    SHARDS_START_EXAMPLE = config.get('shards_start_example', None)
 
     # model
     MODEL = config['model']
@@ -66,6 +75,10 @@ def main(config_filename: str):
     CHAR_ERR_DISTRIBUTION = config['char_err_distribution']
     TOKEN_ERR_PROB = config['token_err_prob']   
     CHAR_ERR_PROB = config['char_err_prob']
+    # aspell suggestions cache
+    ASPELL_CACHE_SIZE = config.get('aspell_cache_size', 0)
+    ASPELL_SUGGESTIONS_FILE = config.get('aspell_suggestions_file', None)
+    ASPELL_CACHE_WARM_SIZE = config.get('aspell_cache_warm_size', 50_000)
 
     # logs
     LOG_FILE = config['log_file']
@@ -96,8 +109,6 @@ def main(config_filename: str):
     ###
 
     ### Dataset loading:
-    manager = Manager()
-    queue = manager.Queue(4 * NUM_PARALLEL)
     if not ERRORS_FROM_FILE:
         char_level_params = [prob for prob in CHAR_ERR_DISTRIBUTION]
         char_level_params.append(CHAR_ERR_PROB)
@@ -108,6 +119,7 @@ def main(config_filename: str):
         #     CHAR_ERR_DISTRIBUTION, CHAR_ERR_PROB, 0.01,
         #     TOKEN_ERR_DISTRIBUTION, TOKEN_ERR_PROB, 0.2)
         # gel = None
+        error_generator = None
         gel = load_data.GenereteErrorLine(
             tokens, characters, LANG, 
             TOKEN_ERR_DISTRIBUTION, CHAR_ERR_DISTRIBUTION, 
@@ -116,29 +128,48 @@ def main(config_filename: str):
         gel = None
         error_generator = None
 
-    # main process that creates pool, goes over possible files and manage other read processes
-    process = Process(
-                target=load_data.data_generator, 
-                args=(queue, DATA_PATHS, NUM_PARALLEL, gel, tokenizer, MAX_LENGTH, ERRORS_FROM_FILE, REVERTED_PIPELINE, error_generator, LANG, ))
-
-    process.start()
-
-    dataset = tf.data.Dataset.from_generator(
-        lambda: iter(queue.get, None),
-        output_types={
-                    "input_ids": tf.int32,
-                    "attention_mask": tf.int32,
-                    "tokenized_target_line": tf.int32,
-                    "original_sentence": tf.string,
-                    "correct_sentence": tf.string,
-                },
-        output_shapes={
-                    "input_ids": (None, ),
-                    "attention_mask": (None, ),
-                    "tokenized_target_line": (None, ),
-                    "original_sentence": (),
-                    "correct_sentence": (),
-                })
+    # table of suggestions for the most frequent tokens, it is shared by all data loading processes
+    if not ERRORS_FROM_FILE:
+        aspell_cache.ensure_warm_table(ASPELL_SUGGESTIONS_FILE, LANG, TOKEN_FILE, ASPELL_CACHE_WARM_SIZE)
+
+    if SHARDS_DIR:
+        start_example = SHARDS_START_EXAMPLE
+        if start_example is None:
+            start_example = dataset_utils.get_shards_resume_example(
+                SHARDS_DIR, BACKUP_DIR, STEPS_PER_EPOCH, BUCKET_BOUNDARIES, bucket_batch_sizes)
+        dataset = dataset_utils.create_shard_dataset(SHARDS_DIR, SEED, start_example)
+    else:
+        # shared memory of SharedMemoryQueue is released at exit of this process (see shm_queue)
+        if SHARED_MEMORY_QUEUE:
+            queue = shm_queue.SharedMemoryQueue(4 * NUM_PARALLEL, MAX_LENGTH)
+        else:
+            manager = Manager()
+            queue = manager.Queue(4 * NUM_PARALLEL)
+
+        # main process that creates pool, goes over possible files and manage other read processes
+        process = Process(
+                    target=load_data.data_generator, 
+                    args=(queue, DATA_PATHS, NUM_PARALLEL, gel, tokenizer, MAX_LENGTH, ERRORS_FROM_FILE, REVERTED_PIPELINE, error_generator, LANG,
+                          TOKENIZE_BATCH_SIZE, ASPELL_CACHE_SIZE, ASPELL_SUGGESTIONS_FILE, ))
+
+        process.start()
+
+        dataset = tf.data.Dataset.from_generator(
+            lambda: iter(queue.get, None),
+            output_types={
+                        "input_ids": tf.int32,
+                        "attention_mask": tf.int32,
+                        "tokenized_target_line": tf.int32,
+                        "original_sentence": tf.string,
+                        "correct_sentence": tf.string,
+                    },
+            output_shapes={
+                        "input_ids": (None, ),
+                        "attention_mask": (None, ),
+                        "tokenized_target_line": (None, ),
+                        "original_sentence": (),
+                        "correct_sentence": (),
+                    })
 
     dataset = dataset.map(lambda input_batch: dataset_utils.fix_format(input_batch, MODEL_TYPE), num_parallel_calls=tf.data.experimental.AUTOTUNE)
     dataset = dataset.map(dataset_utils.split_features_and_labels, num_parallel_calls=tf.data.experimental.AUTOTUNE)
@@ -0,0 +1,203 @@
+import os
+import mmap
+import struct
+import numpy as np
+
+from typing import List, Tuple
+from collections import OrderedDict
+
+###
+#
+# Cache of aspell suggestions.
+#
+#   CachedSpeller wraps aspell.Speller (it has same suggest method) and keeps recent suggestions in LRU cache.
+#   Suggestions can be also looked up in SuggestionTable, a read-only file with sorted tokens and their suggestions.
+#   The table is memory-mapped, so all data_loader processes share one copy of it in page cache.
+#   Table for whole token vocabulary is created by utils/creating_scripts/create_suggestion_table.py,
+#   with such table aspell is used (and created by LazySpeller) only for tokens that are not in table.
+#
+#   Layout of table file:
+#     magic (4 bytes), number of tokens N (uint64),
+#     uint64 token offsets[N+1], uint64 suggestion offsets[N+1],
+#     UTF-8 tokens sorted by their bytes, UTF-8 suggestions of every token joined by tab.
+#
+#   Only first MAX_SUGGESTIONS suggestions are stored, all callers use aspell_speller.suggest(token)[:10].
+#   CachedSpeller returns suggestions as tuples, so caller cannot change cached suggestions.
+#
+###
+
+MAGIC = b'ASPT'
+HEADER_FORMAT = '<4sQ'
+MAX_SUGGESTIONS = 10
+
+
+def write_suggestion_table(path: str, suggestions: dict):
+    tokens = sorted(suggestions.keys(), key=lambda token: token.encode('utf-8'))
+    token_bytes = [token.encode('utf-8') for token in tokens]
+    suggestion_bytes = ['\t'.join(suggestions[token][:MAX_SUGGESTIONS]).encode('utf-8') for token in tokens]
+
+    token_offsets = np.zeros(len(tokens) + 1, dtype=np.uint64)
+    token_offsets[1:] = np.cumsum([len(b) for b in token_bytes], dtype=np.uint64)
+    suggestion_offsets = np.zeros(len(tokens) + 1, dtype=np.uint64)
+    suggestion_offsets[1:] = np.cumsum([len(b) for b in suggestion_bytes], dtype=np.uint64)
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, len(tokens)))
+        f.write(token_offsets.tobytes())
+        f.write(suggestion_offsets.tobytes())
+        f.write(b''.join(token_bytes))
+        f.write(b''.join(suggestion_bytes))
+    os.replace(tmp_path, path)
+
+
+class SuggestionTable:
+    '''
+    Read-only memory-mapped table of suggestions, tokens are found by binary search.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.num_tokens = struct.unpack_from(HEADER_FORMAT, self._buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a suggestion table.")
+
+        position = struct.calcsize(HEADER_FORMAT)
+        self._token_offsets = np.frombuffer(self._buffer, dtype=np.uint64, count=self.num_tokens + 1, offset=position)
+        position += 8 * (self.num_tokens + 1)
+        self._suggestion_offsets = np.frombuffer(self._buffer, dtype=np.uint64, count=self.num_tokens + 1, offset=position)
+        position += 8 * (self.num_tokens + 1)
+        self._tokens_start = position
+        self._suggestions_start = position + int(self._token_offsets[-1])
+
+    def __len__(self) -> int:
+        return self.num_tokens
+
+    def _get_token(self, index: int) -> bytes:
+        start = self._tokens_start + int(self._token_offsets[index])
+        end = self._tokens_start + int(self._token_offsets[index + 1])
+        return self._buffer[start:end]
+
+    def _get_suggestions(self, index: int) -> List[str]:
+        start = self._suggestions_start + int(self._suggestion_offsets[index])
+        end = self._suggestions_start + int(self._suggestion_offsets[index + 1])
+        if start == end:
+            return []
+        return self._buffer[start:end].decode('utf-8').split('\t')
+
+    def get(self, token: str):
+        # Returns suggestions or None if token is not in table.
+        key = token.encode('utf-8')
+        low, high = 0, self.num_tokens
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_token(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.num_tokens and self._get_token(low) == key:
+            return self._get_suggestions(low)
+        return None
+
+    def items(self):
+        for index in range(self.num_tokens):
+            yield self._get_token(index).decode('utf-8'), self._get_suggestions(index)
+
+
+class LazySpeller:
+    '''
+    Creates aspell.Speller at first call of suggest, so processes that find all tokens in table never create it.
+    '''
+    def __init__(self, lang: str):
+        self.lang = lang
+        self._aspell_speller = None
+
+    def suggest(self, token: str) -> List[str]:
+        if self._aspell_speller is None:
+            import aspell
+            self._aspell_speller = aspell.Speller('lang', self.lang)
+        return self._aspell_speller.suggest(token)
+
+
+class CachedSpeller:
+    '''
+    Drop-in replacement of aspell.Speller for suggest(), it asks LRU cache, then table and then aspell.
+    '''
+    def __init__(self, aspell_speller, cache_size: int = 100_000, table: SuggestionTable = None):
+        self.aspell_speller = aspell_speller
+        self.cache_size = cache_size
+        self.table = table
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def suggest(self, token: str) -> Tuple[str, ...]:
+        suggestions = self._cache.get(token, None)
+        if suggestions is not None:
+            self._cache.move_to_end(token)
+            self.hits += 1
+            return suggestions
+
+        if self.table is not None:
+            suggestions = self.table.get(token)
+        if suggestions is not None:
+            suggestions = tuple(suggestions)
+            self.hits += 1
+        else:
+            suggestions = tuple(self.aspell_speller.suggest(token)[:MAX_SUGGESTIONS])
+            self.misses += 1
+
+        if self.cache_size > 0:
+            self._cache[token] = suggestions
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return suggestions
+
+    def warm(self, tokens: List[str]):
+        for token in tokens:
+            self.suggest(token)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def get_stats(self) -> str:
+        return f"aspell cache: {self.hits} hits, {self.misses} misses, hit rate {self.hit_rate:.3f}"
+
+    def save(self, path: str):
+        # Stores table and cached suggestions together into new table.
+        suggestions = dict(self.table.items()) if self.table is not None else {}
+        suggestions.update(self._cache)
+        write_suggestion_table(path, suggestions)
+
+
+def get_frequent_tokens(tsv_token_file: str, num_tokens: int) -> List[str]:
+    # Returns num_tokens most frequent alphabetic tokens from TSV file with tokens and frequencies
+    # (same file as introduce_errors.get_token_vocabulary reads).
+    tokens = []
+    with open(tsv_token_file) as reader:
+        for line in reader:
+            token, freq = line.strip('\n').split('\t')
+            if token.isalpha():
+                tokens.append((float(freq), token))
+    tokens.sort(key=lambda item: -item[0])
+    return [token for _, token in tokens[:num_tokens]]
+
+
+def create_warm_table(path: str, aspell_speller, tsv_token_file: str, num_tokens: int):
+    # Creates table with suggestions for num_tokens most frequent tokens.
+    cached_speller = CachedSpeller(aspell_speller, cache_size=num_tokens)
+    cached_speller.warm(get_frequent_tokens(tsv_token_file, num_tokens))
+    cached_speller.save(path)
+
+
+def ensure_warm_table(path: str, lang: str, tsv_token_file: str, num_tokens: int):
+    # Creates table of suggestions for the most frequent tokens if path is given and table does not exist yet,
+    # it is called once by main process before data loading processes open the table.
+    if not path or os.path.isfile(path):
+        return
+    print("Create table of aspell suggestions...")
+    create_warm_table(path, LazySpeller(lang), tsv_token_file, num_tokens)
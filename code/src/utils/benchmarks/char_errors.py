@@ -0,0 +1,83 @@
+import sys
+sys.path.append('../..')
+
+import math
+import time
+import argparse
+import numpy as np
+
+from collections import Counter
+
+from utils import introduce_errors
+from utils import introduce_errors_v2
+
+# Compares introduce_errors.introduce_char_level_errors_on_sentence (vectorized draws)
+# with the original loop in introduce_errors_v2.introduce_char_level_errors_on_sentence:
+#   - chi-square test of homogeneity of their output distributions on one short sentence,
+#   - time per sentence on sentences from a file.
+
+CHAR_ERR_DISTRIBUTION = [0.2, 0.2, 0.2, 0.2, 0.2]
+
+
+def chi_square_p_value(statistic: float, dof: int) -> float:
+    # Wilson-Hilferty approximation of chi-square survival function.
+    z = ((statistic / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def homogeneity_test(counts_a: Counter, counts_b: Counter, min_count: int = 20):
+    # Categories with small counts are merged into one category.
+    categories = [c for c in set(counts_a) | set(counts_b) if counts_a[c] + counts_b[c] >= min_count]
+    rest_a = sum(counts_a.values()) - sum(counts_a[c] for c in categories)
+    rest_b = sum(counts_b.values()) - sum(counts_b[c] for c in categories)
+    table = np.array([[counts_a[c] for c in categories] + [rest_a], [counts_b[c] for c in categories] + [rest_b]], dtype=np.float64)
+    table = table[:, table.sum(axis=0) > 0]
+    expected = table.sum(axis=1, keepdims=True) * table.sum(axis=0, keepdims=True) / table.sum()
+    statistic = float(((table - expected) ** 2 / expected).sum())
+    dof = table.shape[1] - 1
+    if dof == 0:
+        raise ValueError("Too few samples per output, use more samples or shorter sentence.")
+    return statistic, dof, chi_square_p_value(statistic, dof)
+
+
+def sample(function, sentence: str, num_samples: int, err_prob: float, characters) -> Counter:
+    return Counter(function(sentence, *CHAR_ERR_DISTRIBUTION, err_prob, 0.01, characters) for _ in range(num_samples))
+
+
+def benchmark(function, sentences, err_prob: float, characters) -> float:
+    start = time.perf_counter()
+    for sentence in sentences:
+        function(sentence, *CHAR_ERR_DISTRIBUTION, err_prob, 0.01, characters)
+    return (time.perf_counter() - start) / len(sentences)
+
+
+def main(args):
+    characters = introduce_errors.get_char_vocabulary(args.lang)
+
+    np.random.seed(args.seed)
+    counts_new = sample(introduce_errors.introduce_char_level_errors_on_sentence, args.sentence, args.num_samples, args.test_err_prob, characters)
+    counts_old = sample(introduce_errors_v2.introduce_char_level_errors_on_sentence, args.sentence, args.num_samples, args.test_err_prob, characters)
+    statistic, dof, p_value = homogeneity_test(counts_new, counts_old)
+    print(f"Chi-square: {statistic:.2f}, degrees of freedom: {dof}, p-value: {p_value:.4f}")
+
+    with open(args.input) as f:
+        sentences = [line.strip('\n') for line in f]
+    sentences = (sentences * (args.num_sentences // len(sentences) + 1))[:args.num_sentences]
+    time_new = benchmark(introduce_errors.introduce_char_level_errors_on_sentence, sentences, args.err_prob, characters)
+    time_old = benchmark(introduce_errors_v2.introduce_char_level_errors_on_sentence, sentences, args.err_prob, characters)
+    print(f"Loop version:\t\t{time_old * 1e6:.1f} us/sentence")
+    print(f"Vectorized version:\t{time_new * 1e6:.1f} us/sentence")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--input", type=str, default="../../../data/tokenized/example_01.txt", help="File with sentences for time measurement.")
+    parser.add_argument("--lang", type=str, default="cs", help="Language of char vocabulary.")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed.")
+    parser.add_argument("--sentence", type=str, default="Ať žije čáp !", help="Sentence for statistical test.")
+    parser.add_argument("--num-samples", type=int, default=100_000, help="Number of samples for statistical test.")
+    parser.add_argument("--test-err-prob", type=float, default=0.2, help="Char error probability for statistical test.")
+    parser.add_argument("--err-prob", type=float, default=0.02, help="Char error probability for time measurement.")
+    parser.add_argument("--num-sentences", type=int, default=20_000, help="Number of sentences for time measurement.")
+    args = parser.parse_args()
+    main(args)
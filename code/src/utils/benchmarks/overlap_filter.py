@@ -0,0 +1,86 @@
+import sys
+sys.path.append('../..')
+
+import time
+import random
+import argparse
+import numpy as np
+
+from utils import create_errors
+
+# Compares create_errors.get_overlap_mask (token occupancy bitmaps) with the original quadratic mask
+# (every range against all previous ranges by ErrorGenerator.is_overlap):
+#   - both have to return same mask on random candidate ranges (all error types, shuffled as in get_edits),
+#   - sort_edits has to give the same order as the original two argsorts (made stable, original order of ties was arbitrary),
+#   - time per sentence.
+
+SPAN_LENGTHS = [0, 1, 1, 1, 1, 2] # Insert, MeMne/Replace/Delete/Recase, Swap
+
+
+def get_random_ranges(num_tokens: int, num_error_types: int):
+    ranges = []
+    for _ in range(num_error_types):
+        span_length = random.choice(SPAN_LENGTHS)
+        for start in range(num_tokens - span_length + 1):
+            if random.random() < 0.7:
+                ranges.append((start, start + span_length))
+    random.shuffle(ranges)
+    return ranges
+
+
+def quadratic_mask(error_generator: create_errors.ErrorGenerator, ranges):
+    return [not any([error_generator.is_overlap(current_range, r) if j < i else False for j, r in enumerate(ranges)])
+            for i, current_range in enumerate(ranges)]
+
+
+def argsort_order(ranges, reverse: bool):
+    reverse_index = -1 if reverse else 1
+    order = np.argsort([reverse_index * end for _, end in ranges], kind='stable')
+    order = order[np.argsort([reverse_index * ranges[i][0] for i in order], kind='stable')]
+    return [ranges[i] for i in order]
+
+
+class Range:
+    def __init__(self, o_start: int, o_end: int):
+        self.o_start = o_start
+        self.o_end = o_end
+
+
+def main(args):
+    random.seed(args.seed)
+    error_generator = create_errors.ErrorGenerator(None, None, None, None, None, None, None, None)
+    samples = [get_random_ranges(random.randint(0, args.max_tokens), args.num_error_types) for _ in range(args.num_sentences)]
+
+    for ranges in samples:
+        mask = create_errors.get_overlap_mask(ranges)
+        assert mask == quadratic_mask(error_generator, ranges), f"different mask for {ranges}"
+        for reverse in [False, True]:
+            sorted_ranges = [(r.o_start, r.o_end) for r in error_generator.sort_edits([Range(*r) for r in ranges], reverse)]
+            assert sorted_ranges == argsort_order(ranges, reverse), f"different order for {ranges}"
+    print(f"Same masks and order on {len(samples)} sentences.")
+
+    start = time.perf_counter()
+    for ranges in samples:
+        quadratic_mask(error_generator, ranges)
+    quadratic_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for ranges in samples:
+        create_errors.get_overlap_mask(ranges)
+    bitmap_time = time.perf_counter() - start
+
+    num_ranges = sum(len(ranges) for ranges in samples) / len(samples)
+    print(f"{num_ranges:.1f} candidates per sentence")
+    print(f"  quadratic: {1e6 * quadratic_time / len(samples):.1f} us/sentence")
+    print(f"  bitmap:    {1e6 * bitmap_time / len(samples):.1f} us/sentence")
+    print(f"  speedup:   {quadratic_time / bitmap_time:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--num-sentences", type=int, default=2_000, help="Number of random sentences.")
+    parser.add_argument("--max-tokens", type=int, default=60, help="Maximal number of tokens of sentence.")
+    parser.add_argument("--num-error-types", type=int, default=6, help="Number of error types proposing candidates.")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,68 @@
+import sys
+sys.path.append('../..')
+
+import time
+import argparse
+import numpy as np
+
+from multiprocessing import Process, Manager
+
+from utils import shm_queue
+
+# Compares throughput of Manager().Queue and shm_queue.SharedMemoryQueue
+# with examples of same shape as load_data.data_loader produces.
+
+
+def create_dato(rng, max_length: int) -> dict:
+    length = int(rng.integers(8, max_length))
+    target_length = int(rng.integers(8, max_length))
+    dato = {
+        "input_ids": rng.integers(0, 32000, length).astype(np.int32),
+        "attention_mask": np.ones(length, dtype=np.int32),
+        "tokenized_target_line": rng.integers(0, 32000, target_length).astype(np.int32),
+        "original_sentence": "Příliš žluťoučký kůň úpěl ďábelské ódy " * (length // 8),
+        "correct_sentence": "Příliš žluťoučký kůň úpěl ďábelské ódy " * (target_length // 8),
+    }
+    return dato
+
+
+def producer(queue, num_items: int, max_length: int, seed: int):
+    rng = np.random.default_rng(seed)
+    datos = [create_dato(rng, max_length) for _ in range(64)]
+    for i in range(num_items):
+        queue.put(datos[i % len(datos)])
+
+
+def measure(queue, num_producers: int, num_items: int, max_length: int) -> float:
+    items_per_producer = num_items // num_producers
+    processes = [Process(target=producer, args=(queue, items_per_producer, max_length, seed)) for seed in range(num_producers)]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    for _ in range(items_per_producer * num_producers):
+        queue.get()
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    return items_per_producer * num_producers / elapsed
+
+
+def main(args):
+    manager = Manager()
+    manager_queue = manager.Queue(4 * args.num_producers)
+    throughput = measure(manager_queue, args.num_producers, args.num_items, args.max_length)
+    print(f"Manager().Queue:\t{throughput:.0f} examples/s")
+
+    shared_queue = shm_queue.SharedMemoryQueue(4 * args.num_producers, args.max_length)
+    throughput = measure(shared_queue, args.num_producers, args.num_items, args.max_length)
+    print(f"SharedMemoryQueue:\t{throughput:.0f} examples/s")
+    shared_queue.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--num-producers", type=int, default=8, help="Number of producing processes.")
+    parser.add_argument("--num-items", type=int, default=100_000, help="Number of examples.")
+    parser.add_argument("--max-length", type=int, default=128, help="Max length of token arrays.")
+    args = parser.parse_args()
+    main(args)
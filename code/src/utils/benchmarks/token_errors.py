@@ -0,0 +1,96 @@
+import sys
+sys.path.append('../..')
+
+import time
+import argparse
+import numpy as np
+
+from collections import Counter
+
+from utils import introduce_errors
+from char_errors import homogeneity_test
+
+# Compares introduce_errors.introduce_token_level_errors_on_sentences (batch, used by load_data.GenereteErrorLine)
+# with the original loop in introduce_errors.introduce_token_level_errors_on_sentence:
+#   - chi-square test of homogeneity of their output distributions on one short sentence
+#     (fails if p-value is below --alpha),
+#   - the last vocabulary word and the last aspell suggestion have to be drawn as often as by the loop,
+#   - time per sentence.
+# Speller has fixed suggestions, so the test does not depend on aspell dictionary.
+
+TOKEN_ERR_DISTRIBUTION = [0.3, 0.2, 0.15, 0.15, 0.2] # replace insert delete swap recase
+WORD_VOCABULARY = ["pes", "kočka", "dům", "strom", "auto"]
+
+
+class FixedSpeller:
+    def suggest(self, token: str):
+        return [token + "a", token + "e", token.upper()]
+
+
+def sample_loop(sentence: str, num_samples: int, err_prob: float, std_dev: float) -> Counter:
+    speller = FixedSpeller()
+    return Counter(introduce_errors.introduce_token_level_errors_on_sentence(sentence.split(' '), *TOKEN_ERR_DISTRIBUTION, err_prob, std_dev,
+                                                                             WORD_VOCABULARY, speller)
+                   for _ in range(num_samples))
+
+
+def sample_batch(sentence: str, num_samples: int, err_prob: float, std_dev: float, batch_size: int = 1000) -> Counter:
+    speller = FixedSpeller()
+    counts = Counter()
+    for start in range(0, num_samples, batch_size):
+        sentences_tokens = [sentence.split(' ') for _ in range(min(batch_size, num_samples - start))]
+        counts.update(introduce_errors.introduce_token_level_errors_on_sentences(sentences_tokens, *TOKEN_ERR_DISTRIBUTION, err_prob, std_dev,
+                                                                                 WORD_VOCABULARY, speller))
+    return counts
+
+
+def count_tokens(counts: Counter, token: str) -> int:
+    return sum(count * output.split(' ').count(token) for output, count in counts.items())
+
+
+def main(args):
+    np.random.seed(args.seed)
+    counts_batch = sample_batch(args.sentence, args.num_samples, args.test_err_prob, 0.2)
+    counts_loop = sample_loop(args.sentence, args.num_samples, args.test_err_prob, 0.2)
+    statistic, dof, p_value = homogeneity_test(counts_batch, counts_loop)
+    print(f"Chi-square: {statistic:.2f}, degrees of freedom: {dof}, p-value: {p_value:.4f}")
+
+    last_word = WORD_VOCABULARY[-1]
+    last_suggestion = FixedSpeller().suggest(args.sentence.split(' ')[0])[-1]
+    for token in [last_word, last_suggestion]:
+        batch, loop = count_tokens(counts_batch, token), count_tokens(counts_loop, token)
+        print(f"'{token}': batch {batch}, loop {loop}")
+        # both counts are (roughly) Poisson, difference has to be within 5 standard deviations
+        assert abs(batch - loop) <= 5 * np.sqrt(batch + loop + 1), f"'{token}' is drawn {batch} times by batch version and {loop} times by loop"
+    assert p_value >= args.alpha, f"Output distributions differ (p-value {p_value:.4f})"
+
+    with open(args.input) as f:
+        sentences = [line.strip('\n') for line in f]
+    sentences = (sentences * (args.num_sentences // len(sentences) + 1))[:args.num_sentences]
+    speller = FixedSpeller()
+    start = time.perf_counter()
+    for sentence in sentences:
+        introduce_errors.introduce_token_level_errors_on_sentence(sentence.split(' '), *TOKEN_ERR_DISTRIBUTION, args.err_prob, 0.2,
+                                                                  WORD_VOCABULARY, speller)
+    time_loop = (time.perf_counter() - start) / len(sentences)
+    start = time.perf_counter()
+    for batch_start in range(0, len(sentences), 1000):
+        introduce_errors.introduce_token_level_errors_on_sentences([sentence.split(' ') for sentence in sentences[batch_start:batch_start + 1000]],
+                                                                   *TOKEN_ERR_DISTRIBUTION, args.err_prob, 0.2, WORD_VOCABULARY, speller)
+    time_batch = (time.perf_counter() - start) / len(sentences)
+    print(f"Loop version:\t\t{time_loop * 1e6:.1f} us/sentence")
+    print(f"Batch version:\t\t{time_batch * 1e6:.1f} us/sentence")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--input", type=str, default="../../../data/tokenized/example_01.txt", help="File with sentences for time measurement.")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed.")
+    parser.add_argument("--sentence", type=str, default="Ahoj , to je Praha", help="Sentence for statistical test.")
+    parser.add_argument("--num-samples", type=int, default=100_000, help="Number of samples for statistical test.")
+    parser.add_argument("--test-err-prob", type=float, default=0.4, help="Token error probability for statistical test.")
+    parser.add_argument("--alpha", type=float, default=0.001, help="Minimal p-value of statistical test.")
+    parser.add_argument("--err-prob", type=float, default=0.15, help="Token error probability for time measurement.")
+    parser.add_argument("--num-sentences", type=int, default=20_000, help="Number of sentences for time measurement.")
+    args = parser.parse_args()
+    main(args)
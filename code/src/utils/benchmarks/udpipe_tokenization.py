@@ -0,0 +1,60 @@
+import sys
+sys.path.append('../..')
+
+import os
+import time
+import argparse
+
+from utils.udpipe_tokenizer.udpipe_tokenizer import UDPipeTokenizer
+
+# Compares UDPipeTokenizer.tokenize (new native tokenizer and Token objects for every line)
+# with UDPipeTokenizer.tokenize_batch (one reused native tokenizer, strings only):
+#   - both have to return same tokenized lines,
+#   - time per sentence.
+
+
+def tokenize_per_line(udpipe_tokenizer: UDPipeTokenizer, lines, first_sentence_only: bool):
+    tokenized_lines = []
+    for line in lines:
+        tokenization = udpipe_tokenizer.tokenize(line)
+        if first_sentence_only:
+            sentence = " ".join([token.string for token in tokenization[0]]) if len(tokenization) > 0 else ""
+        else:
+            sentence = " ".join([token.string for tokens_of_part in tokenization for token in tokens_of_part]) if len(tokenization) > 0 else ""
+        tokenized_lines.append(sentence)
+    return tokenized_lines
+
+
+def main(args):
+    with open(args.input) as reader:
+        lines = [line.rstrip('\n') for _, line in zip(range(args.num_sentences), reader)]
+
+    # models without paths are loaded from model directory
+    os.chdir(args.model_dir)
+    udpipe_tokenizer = UDPipeTokenizer(args.lang, nopaths=True)
+
+    for first_sentence_only in [False, True]:
+        start = time.perf_counter()
+        expected = tokenize_per_line(udpipe_tokenizer, lines, first_sentence_only)
+        per_line_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        tokenized_lines = udpipe_tokenizer.tokenize_batch(lines, first_sentence_only)
+        batch_time = time.perf_counter() - start
+
+        assert tokenized_lines == expected, "tokenize_batch returns different tokenization"
+        print(f"first_sentence_only={first_sentence_only}, {len(lines)} sentences")
+        print(f"  tokenize:       {per_line_time:.2f} s ({1e6 * per_line_time / len(lines):.1f} us/sentence)")
+        print(f"  tokenize_batch: {batch_time:.2f} s ({1e6 * batch_time / len(lines):.1f} us/sentence)")
+        print(f"  speedup:        {per_line_time / batch_time:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--input", type=str, default="../../../data/tokenized/example_01.txt", help="File with sentences.")
+    parser.add_argument("--num-sentences", type=int, default=10_000, help="Number of sentences.")
+    parser.add_argument("--lang", type=str, default="cs", help="Model of UDPipeTokenizer.")
+    parser.add_argument("--model-dir", type=str, default="../udpipe_tokenizer", help="Directory with UDPipe models.")
+    args = parser.parse_args()
+    args.input = os.path.abspath(args.input)
+    main(args)
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import ctypes
+import ctypes.util
+import select
+
+from typing import List
+
+###
+#
+# Watcher of checkpoints created by ModelCheckpoint (directories "ckpt-<epoch>/" in checkpoint directory).
+#
+#   - checkpoint is ready when its TF index file ("*.index") exists and its files are not being written:
+#     sizes and mtimes of all its files are same in scans at least poll_interval seconds apart (or they were
+#     not modified for settle_time seconds, e.g. checkpoints that exist before start of watcher),
+#   - ready checkpoints are returned in numeric order of epoch (ckpt-2 before ckpt-10),
+#   - evaluated and failed checkpoints are stored in ledger (JSON file), so they are not evaluated again
+#     after restart; failed checkpoint is tried again after retry_delay seconds (doubled after every failure,
+#     at most max_retry_delay), max_attempts limits number of attempts (None means no limit),
+#   - watcher waits for changes by inotify (through ctypes), checkpoint directory and all checkpoint
+#     subdirectories are watched; if inotify is not available, directory is polled every poll_interval seconds.
+#
+###
+
+DEFAULT_LEDGER_FILENAME = 'evaluated_checkpoints.json'
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+
+class _Inotify:
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watched = set()
+
+    def add_watch(self, path: str):
+        if path in self._watched:
+            return
+        if self._libc.inotify_add_watch(self._fd, os.fsencode(path), IN_WATCH_MASK) < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        self._watched.add(path)
+
+    def discard_missing(self):
+        # Kernel removes watch of deleted directory by itself, only its path is forgotten.
+        self._watched = {path for path in self._watched if os.path.isdir(path)}
+
+    def wait(self, timeout: float) -> bool:
+        # Returns True if some event came, events are only drained (directory is scanned again anyway).
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self._fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self._fd)
+
+
+class CheckpointWatcher:
+    def __init__(self, directory: str, ledger_file: str = None, prefix: str = 'ckpt-', poll_interval: float = 1.0,
+                 max_attempts: int = None, use_inotify: bool = True, settle_time: float = 10.0, retry_delay: float = 10.0,
+                 max_retry_delay: float = 600.0):
+        self.directory = directory
+        self.ledger_file = ledger_file if ledger_file else os.path.join(directory, DEFAULT_LEDGER_FILENAME)
+        self.prefix = prefix
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.settle_time = settle_time
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.ledger = self._load_ledger()
+
+        self._snapshots = {} # name -> (sizes and mtimes of files of checkpoint, time when they were seen first)
+        self._pending = set() # checkpoints with index file that were still being written in the last scan
+        self._retry_times = {} # name -> time when failed checkpoint can be tried again
+
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError) as e:
+                print(e)
+                print("inotify is not available, checkpoints are polled.")
+
+    def _load_ledger(self) -> dict:
+        if os.path.isfile(self.ledger_file):
+            with open(self.ledger_file) as json_file:
+                ledger = json.load(json_file)
+        else:
+            ledger = {}
+        ledger.setdefault("evaluated", [])
+        ledger.setdefault("failed", {})
+        return ledger
+
+    def _write_ledger(self):
+        tmp_path = f"{self.ledger_file}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w') as json_file:
+            json.dump(self.ledger, json_file, indent=4)
+        os.replace(tmp_path, self.ledger_file)
+
+    def get_epoch(self, name: str):
+        suffix = name[len(self.prefix):]
+        return int(suffix) if name.startswith(self.prefix) and suffix.isdigit() else None
+
+    def _get_snapshot(self, name: str):
+        path = os.path.join(self.directory, name)
+        snapshot = []
+        for root, _, filenames in os.walk(path):
+            for filename in filenames:
+                stat = os.stat(os.path.join(root, filename))
+                snapshot.append((os.path.relpath(os.path.join(root, filename), path), stat.st_size, stat.st_mtime_ns))
+        return sorted(snapshot)
+
+    def is_complete(self, name: str) -> bool:
+        try:
+            snapshot = self._get_snapshot(name)
+        except OSError:
+            # file was removed (or renamed) during scan
+            self._snapshots.pop(name, None)
+            return False
+        now = time.time()
+        previous, since = self._snapshots.get(name, (None, now))
+        if snapshot != previous:
+            since = now
+        self._snapshots[name] = (snapshot, since)
+
+        if not any(filename.endswith('.index') for filename, _, _ in snapshot):
+            self._pending.discard(name)
+            return False
+        newest = max(mtime for _, _, mtime in snapshot) / 1e9
+        if now - since >= self.poll_interval or now - newest >= self.settle_time:
+            self._pending.discard(name)
+            return True
+        self._pending.add(name)
+        return False
+
+    def is_done(self, name: str) -> bool:
+        if name in self.ledger["evaluated"]:
+            return True
+        return self.max_attempts is not None and self.ledger["failed"].get(name, 0) >= self.max_attempts
+
+    def is_waiting_for_retry(self, name: str) -> bool:
+        return self._retry_times.get(name, 0.0) > time.time()
+
+    def get_ready(self) -> List[str]:
+        # Returns complete checkpoints that are not evaluated yet, sorted by epoch.
+        if not os.path.isdir(self.directory):
+            return []
+        names = [name for name in os.listdir(self.directory) if self.get_epoch(name) is not None]
+        # deleted checkpoints are forgotten
+        for name in set(self._snapshots) - set(names):
+            del self._snapshots[name]
+            self._pending.discard(name)
+        if self._inotify is not None:
+            self._inotify.discard_missing()
+            self._add_watches([name for name in names if os.path.isdir(os.path.join(self.directory, name))])
+        ready = [name for name in names
+                 if not self.is_done(name) and not self.is_waiting_for_retry(name) and self.is_complete(name)]
+        return sorted(ready, key=self.get_epoch)
+
+    def _add_watches(self, names: List[str]):
+        try:
+            self._inotify.add_watch(self.directory)
+            for name in names:
+                self._inotify.add_watch(os.path.join(self.directory, name))
+        except OSError as e:
+            # checkpoint can be deleted between listdir and add_watch
+            print(e)
+
+    def get_timeout(self) -> float:
+        # Checkpoint that is being written is scanned again after poll_interval (the last write may not
+        # produce any event), failed checkpoint when its retry delay ends.
+        timeout = 60.0
+        if self._pending:
+            timeout = self.poll_interval
+        now = time.time()
+        for retry_time in self._retry_times.values():
+            if retry_time > now:
+                timeout = min(timeout, retry_time - now)
+        return timeout
+
+    def wait(self, timeout: float = None):
+        # Waits for change in checkpoint directory (or for poll_interval without inotify).
+        if self._inotify is not None and os.path.isdir(self.directory):
+            self._inotify.wait(timeout if timeout is not None else self.get_timeout())
+        else:
+            time.sleep(min(self.poll_interval, timeout) if timeout is not None else self.poll_interval)
+
+    def mark_evaluated(self, name: str):
+        self.ledger["evaluated"].append(name)
+        self.ledger["failed"].pop(name, None)
+        self._retry_times.pop(name, None)
+        self._write_ledger()
+
+    def mark_failed(self, name: str):
+        failures = self.ledger["failed"].get(name, 0) + 1
+        self.ledger["failed"][name] = failures
+        self._retry_times[name] = time.time() + min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay)
+        self._write_ledger()
+
+    def watch(self):
+        # Yields ready checkpoints forever, every checkpoint has to be marked as evaluated or failed by caller.
+        while True:
+            ready = self.get_ready()
+            if ready:
+                yield ready[0]
+            else:
+                self.wait()
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
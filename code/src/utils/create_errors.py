@@ -1,15 +1,21 @@
+import os
 import string
 import aspell
 import errant
 import random
+import shutil
 import argparse
 import numpy as np
 
 # from edit import Edit
-from .edit import Edit
+from .edit import Edit, EditRecord, StringTable, apply_edits
+from . import aspell_cache
+from . import line_index
 from typing import List
+from multiprocessing import Pool
 from spacy.tokens import Doc
 from itertools import compress
+from collections import OrderedDict, namedtuple
 from abc import ABC, abstractmethod
 from errant.annotator import Annotator
 
@@ -21,127 +27,235 @@ czech_diacritizables_chars = [char for sublist in czech_diacritics_tuples for ch
                                                                                                   sublist]
 
 
+class CachedParser:
+    '''
+    Wraps errant Annotator: input sentences are parsed in batches by nlp.pipe, parses of corrections
+    are kept in LRU cache and corrections that need only text are created without parsing (make_doc).
+    '''
+    def __init__(self, annotator: Annotator, cache_size: int = 100_000, batch_size: int = 256, n_process: int = 1):
+        self.annotator = annotator
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self._cache = OrderedDict()
+
+    def make_doc(self, text: str) -> Doc:
+        # Same tokens as annotator.parse(text) (text is split by whitespace), but without tagging and parsing.
+        return Doc(self.annotator.nlp.vocab, text.split())
+
+    def parse(self, text: str) -> Doc:
+        doc = self._cache.get(text, None)
+        if doc is not None:
+            self._cache.move_to_end(text)
+            return doc
+
+        doc = self.annotator.parse(text)
+        if self.cache_size > 0:
+            self._cache[text] = doc
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return doc
+
+    def parse_sentences(self, sentences: List[str]) -> List[Doc]:
+        # Input sentences are not cached, they are mostly unique.
+        docs = (Doc(self.annotator.nlp.vocab, sentence.split()) for sentence in sentences)
+        return list(self.annotator.nlp.pipe(docs, batch_size=self.batch_size, n_process=self.n_process, disable=["ner"]))
+
+
+# Candidate of edit: only its position in original sentence and error that proposed it,
+# Edit is created by error_instance.create_edit only if candidate is accepted.
+Candidate = namedtuple('Candidate', ['o_start', 'o_end', 'error_instance'])
+
+
 class Error(ABC):
+    # corrections are parsed (tagged) only if error needs more than their text
+    parse_corrections = False
+    # type of created edits
+    edit_type = "NA"
+
     def __init__(self, target_prob: float) -> None:
         self.target_prob = target_prob
         self.num_errors = 0
         self.num_possible_edits = 0
 
+    def get_c_toks(self, annotator: CachedParser, text: str) -> Doc:
+        if self.parse_corrections:
+            return annotator.parse(text)
+        return annotator.make_doc(text)
+
     @abstractmethod
-    def __call__(self, parsed_sentence, annotator: Annotator, aspell_speller = None) -> List[Edit]:
+    def get_candidates(self, parsed_sentence, aspell_speller = None) -> List[tuple]:
+        # Returns cheap candidates (o_start, o_end) of edits, nothing is parsed or sampled here.
         pass
 
+    @abstractmethod
+    def get_correction(self, parsed_sentence, o_start: int, o_end: int, aspell_speller = None) -> str:
+        # Returns correction string (tokens joined by space) for candidate or None if there is no correction for it.
+        pass
+
+    def create_record(self, parsed_sentence, o_start: int, o_end: int, strings: StringTable, aspell_speller = None) -> EditRecord:
+        c_str = self.get_correction(parsed_sentence, o_start, o_end, aspell_speller)
+        if c_str is None:
+            return None
+        return EditRecord(o_start, o_end, o_start, o_start + len(c_str.split()), strings.add(c_str), self.edit_type)
+
+    def create_edit(self, parsed_sentence, o_start: int, o_end: int, annotator: CachedParser, aspell_speller = None) -> Edit:
+        strings = StringTable()
+        record = self.create_record(parsed_sentence, o_start, o_end, strings, aspell_speller)
+        if record is None:
+            return None
+        return record.to_edit(parsed_sentence, strings, lambda text: self.get_c_toks(annotator, text))
+
+    def __call__(self, parsed_sentence, annotator: CachedParser, aspell_speller = None) -> List[Edit]:
+        edits = [self.create_edit(parsed_sentence, o_start, o_end, annotator, aspell_speller) 
+                 for o_start, o_end in self.get_candidates(parsed_sentence, aspell_speller)]
+        return [edit for edit in edits if edit is not None]
+
 
 class ErrorMeMne(Error):
-    def __call__(self, parsed_sentence, annotator: Annotator, aspell_speller = None) -> List[Edit]:
-        edits = []
-        for i, token in enumerate(parsed_sentence):
-            if token.text == "mně":
-                c_toks = annotator.parse("mě")
-                edit = Edit(token, c_toks, [i, i+1, i, i+1], type="MeMne")
-                edits.append(edit)
-            if token.text == "mě":
-                c_toks = annotator.parse("mně")
-                edit = Edit(token, c_toks, [i, i+1, i, i+1], type="MeMne")
-                edits.append(edit)
-        return edits
+    edit_type = "MeMne"
+
+    def get_candidates(self, parsed_sentence, aspell_speller = None) -> List[tuple]:
+        return [(i, i+1) for i, token in enumerate(parsed_sentence) if token.text in ["mně", "mě"]]
+
+    def get_correction(self, parsed_sentence, o_start: int, o_end: int, aspell_speller = None) -> str:
+        return "mě" if parsed_sentence[o_start].text == "mně" else "mně"
 
 
 class ErrorReplace(Error):
-    def __call__(self, parsed_sentence, annotator: Annotator, aspell_speller) -> List[Edit]:
-        edits = []
-        for i, token in enumerate(parsed_sentence):
-            if token.text.isalpha():
-                proposals = aspell_speller.suggest(token.text)[:10]
-                if len(proposals) > 0:
-                    new_token_text = np.random.choice(proposals)
-                    c_toks = annotator.parse(new_token_text)
-                    edit = Edit(token, c_toks, [i, i+1, i, i+1], type="Replace")
-                    edits.append(edit)
-        return edits
+    edit_type = "Replace"
+
+    def __init__(self, target_prob: float, exact_candidates: bool = False) -> None:
+        # If exact_candidates is True, aspell is asked for every alphabetic token and tokens without suggestions
+        # are not candidates, so num_possible_edits is exact (as in the original ErrorReplace), but it is slow.
+        # Otherwise aspell is asked only for accepted candidates and candidate without suggestions is dropped
+        # in get_correction (it is still counted in num_possible_edits).
+        super().__init__(target_prob)
+        self.exact_candidates = exact_candidates
+
+    def get_candidates(self, parsed_sentence, aspell_speller = None) -> List[tuple]:
+        if self.exact_candidates:
+            return [(i, i+1) for i, token in enumerate(parsed_sentence)
+                    if token.text.isalpha() and len(aspell_speller.suggest(token.text)) > 0]
+        return [(i, i+1) for i, token in enumerate(parsed_sentence) if token.text.isalpha()]
+
+    def get_correction(self, parsed_sentence, o_start: int, o_end: int, aspell_speller = None) -> str:
+        proposals = aspell_speller.suggest(parsed_sentence[o_start].text)[:10]
+        if len(proposals) == 0:
+            return None
+        return str(np.random.choice(proposals))
 
 
 class ErrorInsert(Error):
+    edit_type = "Insert"
+
     def __init__(self, target_prob: float, word_vocabulary) -> None:
         super().__init__(target_prob)
         self.word_vocabulary = word_vocabulary
 
-    def __call__(self, parsed_sentence, annotator: Annotator, aspell_speller = None) -> List[Edit]:
-        edits = []
-        for i, token in enumerate(parsed_sentence):
-            new_token_text = np.random.choice(self.word_vocabulary)
-            c_toks = annotator.parse(new_token_text)
-            edit = Edit(token, c_toks, [i, i, i, i+1], type="Insert")
-            edits.append(edit)
-        return edits
+    def get_candidates(self, parsed_sentence, aspell_speller = None) -> List[tuple]:
+        return [(i, i) for i in range(len(parsed_sentence))]
+
+    def get_correction(self, parsed_sentence, o_start: int, o_end: int, aspell_speller = None) -> str:
+        return str(np.random.choice(self.word_vocabulary))
 
 
 class ErrorDelete(Error):
+    edit_type = "Remove"
+
     def __init__(self, target_prob: float) -> None:
         super().__init__(target_prob)
         self.allowed_source_delete_tokens = [',', '.', '!', '?']
 
-    def __call__(self, parsed_sentence, annotator: Annotator, aspell_speller = None) -> List[Edit]:
-        edits = []
-        for i, token in enumerate(parsed_sentence):
-            if token.text.isalpha() and token.text not in self.allowed_source_delete_tokens:
-                c_toks = annotator.parse("")
-                edit = Edit(token, c_toks, [i, i+1, i, i], type="Remove")
-                edits.append(edit)
-        return edits
+    def get_candidates(self, parsed_sentence, aspell_speller = None) -> List[tuple]:
+        return [(i, i+1) for i, token in enumerate(parsed_sentence) 
+                if token.text.isalpha() and token.text not in self.allowed_source_delete_tokens]
+
+    def get_correction(self, parsed_sentence, o_start: int, o_end: int, aspell_speller = None) -> str:
+        return ""
 
 
 class ErrorRecase(Error):
-    def __call__(self, parsed_sentence, annotator: Annotator, aspell_speller = None) -> List[Edit]:
-        edits = []
-        for i, token in enumerate(parsed_sentence):
-            if token.text.islower():
-                new_token_text = token.text[0].upper() + token.text[1:]
-            else:
-                num_recase = min(len(token.text), max(1, int(np.round(np.random.normal(0.3, 0.4) * len(token.text)))))
-                char_ids_to_recase = np.random.choice(len(token.text), num_recase, replace=False)
-                new_token_text = ''
-                for char_i, char in enumerate(token.text):
-                    if char_i in char_ids_to_recase:
-                        if char.isupper():
-                            new_token_text += char.lower()
-                        else:
-                            new_token_text += char.upper()
+    edit_type = "Recase"
+
+    def get_candidates(self, parsed_sentence, aspell_speller = None) -> List[tuple]:
+        return [(i, i+1) for i in range(len(parsed_sentence))]
+
+    def get_correction(self, parsed_sentence, o_start: int, o_end: int, aspell_speller = None) -> str:
+        token = parsed_sentence[o_start]
+        if token.text.islower():
+            new_token_text = token.text[0].upper() + token.text[1:]
+        else:
+            num_recase = min(len(token.text), max(1, int(np.round(np.random.normal(0.3, 0.4) * len(token.text)))))
+            char_ids_to_recase = np.random.choice(len(token.text), num_recase, replace=False)
+            new_token_text = ''
+            for char_i, char in enumerate(token.text):
+                if char_i in char_ids_to_recase:
+                    if char.isupper():
+                        new_token_text += char.lower()
                     else:
-                        new_token_text += char
-            c_toks = annotator.parse(new_token_text)
-            edit = Edit(token, c_toks, [i, i+1, i, i+1], type="Recase")
-            edits.append(edit)
-        return edits
+                        new_token_text += char.upper()
+                else:
+                    new_token_text += char
+        return new_token_text
 
 
 class ErrorSwap(Error):
-    def __call__(self, parsed_sentence, annotator: Annotator, aspell_speller = None) -> List[Edit]:
-        edits = []
-        if len(parsed_sentence) > 1:
-            previous_token = parsed_sentence[0]
-            for i, token in enumerate(parsed_sentence[1:]):
-                i = i + 1
-                c_toks = annotator.parse(token.text + " " + previous_token.text)
-                edit = Edit(token, c_toks, [i-1, i+1, i-1, i+1], type="Swap")
-                edits.append(edit)
-                previous_token = token
-        return edits
+    edit_type = "Swap"
+
+    def get_candidates(self, parsed_sentence, aspell_speller = None) -> List[tuple]:
+        return [(i-1, i+1) for i in range(1, len(parsed_sentence))]
+
+    def get_correction(self, parsed_sentence, o_start: int, o_end: int, aspell_speller = None) -> str:
+        return parsed_sentence[o_start+1].text + " " + parsed_sentence[o_start].text
     
 class GeneralWordError(Error):
     def __init__(self, target_prob: float, word_vocabulary) -> None:
         super().__init__(target_prob)
         self.word_vocabulary = word_vocabulary
 
-    def __call__(self, parsed_sentence, annotator: Annotator, aspell_speller = None) -> List[Edit]:
+    def get_candidates(self, parsed_sentence, aspell_speller = None) -> List[tuple]:
         # TODO: dodelat rychlejsi
         ...
 
+    def get_correction(self, parsed_sentence, o_start: int, o_end: int, aspell_speller = None) -> str:
+        # TODO: dodelat rychlejsi
+        ...
+
+
+def get_overlap_mask(ranges: List[tuple]) -> List[bool]:
+    '''
+    Goes through ranges (o_start, o_end) in given order, range is accepted (True) if it does not overlap
+    any previous range (accepted or not), overlap is defined by ErrorGenerator.is_overlap:
+      - non-empty range [a, b) overlaps previous non-empty range that shares a token with it
+        and previous empty range at position s, where a <= s < b,
+      - empty range at a overlaps only previous non-empty range [s, e), where s < a < e.
+    Previous ranges are stored in token occupancy bitmaps, so time is linear in total length of ranges.
+    '''
+    size = max((end for _, end in ranges), default=0) + 1
+    covered = bytearray(size) # token is covered by previous non-empty range
+    inner = bytearray(size) # position is inside previous non-empty range (not at its boundary)
+    empty = bytearray(size) # previous empty range is at position
+
+    mask = []
+    for start, end in ranges:
+        if start < end:
+            accepted = not any(covered[start:end]) and not any(empty[start:end])
+            covered[start:end] = b'\x01' * (end - start)
+            inner[start + 1:end] = b'\x01' * (end - start - 1)
+        else:
+            accepted = not inner[start]
+            empty[start] = 1
+        mask.append(accepted)
+    return mask
+
+
 # MAIN:
 class ErrorGenerator:
     def __init__(self, word_vocabulary, char_vocabulary,
                  char_err_distribution, char_err_prob, char_err_std,
-                 token_err_distribution, token_err_prob, token_err_std) -> None:
+                 token_err_distribution, token_err_prob, token_err_std,
+                 parse_cache_size: int = 100_000, parse_batch_size: int = 256, parse_processes: int = 1) -> None:
         self.char_err_distribution = char_err_distribution
         self.char_err_prob = char_err_prob
         self.char_err_std = char_err_std
@@ -153,6 +267,10 @@ class ErrorGenerator:
         self.word_vocabulary = word_vocabulary
 
         self.annotator = None
+        self.parser = None
+        self.parse_cache_size = parse_cache_size
+        self.parse_batch_size = parse_batch_size
+        self.parse_processes = parse_processes
 
         self.total_tokens = 0
         self.error_instances = [
@@ -193,55 +311,75 @@ class ErrorGenerator:
     def _init_annotator(self, lang: str = 'cs'):
         if self.annotator is None:
             self.annotator = errant.load(lang)
+            self.parser = CachedParser(self.annotator, self.parse_cache_size, self.parse_batch_size, self.parse_processes)
+
+    def reset_stats(self):
+        # Resets statistics of rejection sampling.
+        self.total_tokens = 0
+        for error_instance in self.error_instances:
+            error_instance.num_errors = 0
+            error_instance.num_possible_edits = 0
+
+    def _get_parser(self, annotator) -> CachedParser:
+        # annotator can be errant Annotator or CachedParser, correction parses are cached only for own annotator
+        if isinstance(annotator, CachedParser):
+            return annotator
+        if annotator is self.annotator:
+            return self.parser
+        return CachedParser(annotator, 0)
 
     def get_edits(self, parsed_sentence, annotator: Annotator, aspell_speller) -> List[Edit]:
+        parser = self._get_parser(annotator)
+        strings = StringTable()
+        records = self.get_records(parsed_sentence, strings, aspell_speller)
+        return self._to_edits(parsed_sentence, records, strings, parser)
+
+    def _to_edits(self, parsed_sentence, records: List[EditRecord], strings: StringTable, parser: CachedParser) -> List[Edit]:
+        # corrections are parsed only if some error needs it (see Error.parse_corrections)
+        make_doc = parser.parse if any(error_instance.parse_corrections for error_instance in self.error_instances) else parser.make_doc
+        return [record.to_edit(parsed_sentence, strings, make_doc) for record in records]
+
+    def get_records(self, parsed_sentence, strings: StringTable, aspell_speller) -> List[EditRecord]:
+        # Same as get_edits, but returns compact EditRecords with corrections stored in strings.
         self.total_tokens += len(parsed_sentence)
-        edits_errors = []
+        candidates = []
         for error_instance in self.error_instances:
-            edits = error_instance(parsed_sentence, annotator, aspell_speller)
-            edits_errors = edits_errors + [(edit, error_instance) for edit in edits]
+            candidates = candidates + [Candidate(o_start, o_end, error_instance) 
+                                       for o_start, o_end in error_instance.get_candidates(parsed_sentence, aspell_speller)]
         
-        if len(edits_errors) == 0:
+        if len(candidates) == 0:
             return []
 
-        # Overlaping:
-        random.shuffle(edits_errors)
-        mask = self.get_remove_mask(list(zip(*edits_errors))[0])
-        edits_errors = list(compress(edits_errors, mask))
+        # Overlaping (on positions of candidates):
+        random.shuffle(candidates)
+        mask = self.get_remove_mask(candidates)
+        candidates = list(compress(candidates, mask))
         
-        ## Rejection Sampling:
-        selected_edits = []
-        for edit, error_instance in edits_errors:
+        ## Rejection Sampling (edits are created only for accepted candidates):
+        selected_records = []
+        for candidate in candidates:
+            error_instance = candidate.error_instance
             gen_prob = error_instance.num_possible_edits / self.total_tokens if self.total_tokens > 0 else 0.5
             acceptance_prob = error_instance.target_prob / (gen_prob + 1e-10)
             if np.random.uniform(0, 1) < acceptance_prob:
-                selected_edits.append(edit)
-                error_instance.num_errors += 1
-        error_instance.num_possible_edits += len(edits_errors)
+                record = error_instance.create_record(parsed_sentence, candidate.o_start, candidate.o_end, strings, aspell_speller)
+                if record is not None:
+                    selected_records.append(record)
+                    error_instance.num_errors += 1
+        error_instance.num_possible_edits += len(candidates)
         ##
 
         # Sorting:
-        sorted_edits = self.sort_edits(selected_edits)
-        return sorted_edits
+        sorted_records = self.sort_edits(selected_records)
+        return sorted_records
     
     def sort_edits(self, edits: List[Edit], reverse: bool = False) -> List[Edit]:
-        reverse_index = -1 if reverse else 1
-        minus_start_indices = [reverse_index * edit.o_end for edit in edits]
-        sorted_edits = np.array(edits)
-        sorted_edits = sorted_edits[np.argsort(minus_start_indices)]
-
-        minus_start_indices = [reverse_index * edit.o_start for edit in sorted_edits]
-        sorted_edits = np.array(sorted_edits)
-        sorted_edits = sorted_edits[np.argsort(minus_start_indices)]
-
-        return sorted_edits.tolist()
-
+        # stable sort by (o_start, o_end)
+        return sorted(edits, key=lambda edit: (edit.o_start, edit.o_end), reverse=reverse)
 
     def get_remove_mask(self, edits: List[Edit]) -> List[bool]:
-        ranges = [(edit.o_start, edit.o_end) for edit in edits]
-        removed = [not any([self.is_overlap(current_range, r) if j < i else False for j, r in enumerate(ranges)]) for i, current_range in enumerate(ranges)]
-        # filtered_edits = list(compress(edits, removed))
-        return removed
+        # True for edits that do not overlap any previous edit (same as is_overlap against all previous edits)
+        return get_overlap_mask([(edit.o_start, edit.o_end) for edit in edits])
 
     def is_overlap(self, range_1: tuple, range_2: tuple) -> bool:
         start_1 = range_1[0]
@@ -379,11 +517,37 @@ class ErrorGenerator:
     
     def create_error_sentence(self, sentence: str, aspell_speller, use_token_level: bool = False, use_char_level: bool = False) -> List[str]:
         parsed_sentence = self.annotator.parse(sentence)
-        edits = self.get_edits(parsed_sentence, self.annotator, aspell_speller)
-        
-        edits = self.sort_edits(edits, reverse=True)
-
-        sentence = self._use_edits(edits, parsed_sentence)
+        return self._create_error_sentence(parsed_sentence, aspell_speller, use_token_level, use_char_level)
+
+    def create_error_sentences(self, sentences: List[str], aspell_speller, use_token_level: bool = False, use_char_level: bool = False) -> List[str]:
+        # Same as create_error_sentence for every sentence, sentences are parsed in batches by nlp.pipe.
+        parsed_sentences = self.parser.parse_sentences(sentences)
+        return [self._create_error_sentence(parsed_sentence, aspell_speller, use_token_level, use_char_level) for parsed_sentence in parsed_sentences]
+
+    def get_m2_edits_and_error_sentences(self, sentences: List[str], aspell_speller, use_token_level: bool = False, 
+                                         use_char_level: bool = False) -> List[tuple]:
+        '''
+        For every sentence returns its M2 edits (same as get_m2_edits_text) and error sentence created by the same edits
+        (token and char level errors are introduced after edits, they are not in M2 edits).
+        Sentences are parsed in batches by nlp.pipe.
+        '''
+        results = []
+        for parsed_sentence in self.parser.parse_sentences(sentences):
+            strings = StringTable()
+            records = self.get_records(parsed_sentence, strings, aspell_speller)
+            m2_edits = [edit.to_m2() for edit in self._to_edits(parsed_sentence, records, strings, self.parser)]
+            sentence = self._use_records(parsed_sentence, records, strings, aspell_speller, use_token_level, use_char_level)
+            results.append((m2_edits, sentence))
+        return results
+
+    def _create_error_sentence(self, parsed_sentence, aspell_speller, use_token_level: bool = False, use_char_level: bool = False) -> str:
+        strings = StringTable()
+        records = self.get_records(parsed_sentence, strings, aspell_speller)
+        return self._use_records(parsed_sentence, records, strings, aspell_speller, use_token_level, use_char_level)
+
+    def _use_records(self, parsed_sentence, records: List[EditRecord], strings: StringTable, aspell_speller, 
+                     use_token_level: bool = False, use_char_level: bool = False) -> str:
+        sentence = apply_edits([token.text for token in parsed_sentence], records, strings)
         
         if use_token_level:
             sentence = self.introduce_token_level_errors_on_sentence(sentence.split(' '), aspell_speller)
@@ -392,26 +556,6 @@ class ErrorGenerator:
             sentence = self.introduce_char_level_errors_on_sentence(sentence)
 
         return sentence
-    
-    def _use_edits(self, edits: List[Edit], parsed_sentence) -> str:
-        if len(edits) == 0:
-            return parsed_sentence.text
-        docs = [edits[0].c_toks]
-        prev_edit = edits[0]
-        for edit in edits[1:]:
-            next_docs = self._merge(prev_edit, edit, parsed_sentence)
-            docs = next_docs + docs
-            prev_edit = edit
-        subtexts = [doc.text for doc in docs]
-        sentence = parsed_sentence[:edits[-1].o_start].text + " " + " ".join(subtexts) + " " + parsed_sentence[edits[0].o_end:].text
-        return sentence
-
-    def _merge(self, prev_edit: Edit, next_edit: Edit, parsed_sentence) -> List:
-        if prev_edit.o_start > next_edit.o_end:
-            docs = [next_edit.c_toks, parsed_sentence[next_edit.o_end:prev_edit.o_start]]
-        else:
-            docs = [next_edit.c_toks]
-        return docs
 
 def get_token_vocabulary(tsv_token_file):
     tokens = []
@@ -432,33 +576,166 @@ def get_char_vocabulary(lang):
         return list(allowed_chars)
 
 
-def main(args):
-    char_vocabulary = get_char_vocabulary(args.lang)
+###
+#
+# Synthetic M2 (main): input file is split into chunks of chunk_size lines, chunks are processed by pool
+# of processes. Every chunk is written into its own part files ("<output>.part-XXXXX", buffered), parts are
+# appended to output in order of chunks as soon as all previous chunks are finished and then they are removed,
+# so output has same order as input and memory does not depend on size of input.
+#   M2 output: "S <correct sentence>" with edits that create errors (get_m2_edits_text) and empty line,
+#   TSV output (optional): "correct_sentence\terror_sentence", error sentence is created by the same edits
+#   and token and char level errors.
+# Random generators are seeded by seed and chunk and statistics of rejection sampling are reset for every chunk,
+# so output does not depend on number of processes.
+#
+###
+
+WRITE_BUFFER_SIZE = 16 * 1024 * 1024
+
+_worker_error_generator = None
+_worker_aspell_speller = None
+
+
+def get_aspell_speller(lang: str, suggestions: str = None):
+    if suggestions:
+        # table of suggestions, aspell is used only for tokens that are not in table
+        return aspell_cache.CachedSpeller(aspell_cache.LazySpeller(lang), 100_000, aspell_cache.SuggestionTable(suggestions))
+    return aspell.Speller('lang', lang)
+
+
+def create_error_generator(lang: str, batch_size: int = 256, parse_processes: int = 1) -> ErrorGenerator:
+    char_vocabulary = get_char_vocabulary(lang)
     word_vocabulary = get_token_vocabulary("../../data/vocabluraries/vocabulary_cs.tsv")
-    aspell_speller = aspell.Speller('lang', args.lang)
     error_generator = ErrorGenerator(word_vocabulary, char_vocabulary,
                                      [0.2, 0.2, 0.2, 0.2, 0.2], 0.02, 0.01,
-                                     [0.7, 0.1, 0.05, 0.1, 0.05], 0.15, 0.2)
-    error_generator._init_annotator()
+                                     [0.7, 0.1, 0.05, 0.1, 0.05], 0.15, 0.2,
+                                     parse_batch_size=batch_size, parse_processes=parse_processes)
+    error_generator._init_annotator(lang)
+    return error_generator
+
+
+def _init_worker(lang: str, suggestions: str, batch_size: int):
+    global _worker_error_generator, _worker_aspell_speller
+    _worker_aspell_speller = get_aspell_speller(lang, suggestions)
+    _worker_error_generator = create_error_generator(lang, batch_size)
+
+
+def get_part_path(path: str, chunk: int) -> str:
+    return f"{path}.part-{chunk:05d}"
+
+
+def create_m2_part(chunk: int, input_path: str, start: int, end: int, output_path: str, tsv_path: str = None,
+                   batch_size: int = 256, seed: int = 42) -> int:
+    # Writes M2 (and TSV) of lines [start, end) of input into part files of chunk, returns chunk.
+    np.random.seed(seed + chunk)
+    random.seed(seed + chunk)
+    # statistics of rejection sampling start from zero, so chunk does not depend on previous chunks of process
+    _worker_error_generator.reset_stats()
+    offsets = line_index.get_line_offsets(input_path)
+
+    m2_writer = open(get_part_path(output_path, chunk), 'w', buffering=WRITE_BUFFER_SIZE)
+    tsv_writer = open(get_part_path(tsv_path, chunk), 'w', buffering=WRITE_BUFFER_SIZE) if tsv_path else None
+
+    def write_batch(lines):
+        results = _worker_error_generator.get_m2_edits_and_error_sentences(lines, _worker_aspell_speller, True, True)
+        for line, (m2_lines, error_line) in zip(lines, results):
+            m2_writer.write("S " + line + "\n" + "".join(m2_line + "\n" for m2_line in m2_lines) + "\n")
+            if tsv_writer is not None:
+                tsv_writer.write(line + "\t" + error_line + "\n")
+
+    lines = []
+    with open(input_path, "r") as f:
+        f.seek(int(offsets[start]))
+        for _ in range(end - start):
+            lines.append(f.readline().strip())
+            if len(lines) == batch_size:
+                write_batch(lines)
+                lines = []
+    if len(lines) > 0:
+        write_batch(lines)
+
+    m2_writer.close()
+    if tsv_writer is not None:
+        tsv_writer.close()
+    return chunk
+
+
+def _create_m2_part(arguments) -> int:
+    return create_m2_part(*arguments)
+
+
+def _append_part(writer, path: str, chunk: int):
+    part_path = get_part_path(path, chunk)
+    with open(part_path, 'rb') as reader:
+        shutil.copyfileobj(reader, writer, WRITE_BUFFER_SIZE)
+    os.remove(part_path)
+
+
+def create_error_lines(args):
+    # Writes line with errors for every input line (output of create_error_sentences).
+    aspell_speller = get_aspell_speller(args.lang, args.suggestions)
+    error_generator = create_error_generator(args.lang, args.batch_size, args.num_processes)
     input_path = args.input
     output_path = args.output
+
+    # output is opened once (appended as before) with large buffer
+    output_file = open(output_path, "a", buffering=WRITE_BUFFER_SIZE)
+
+    def write_batch(lines):
+        error_lines = error_generator.create_error_sentences(lines, aspell_speller, True, True)
+        output_file.write("".join(error_line + "\n" for error_line in error_lines))
+
+    lines = []
     with open(input_path, "r") as f:
         while True:
             line = f.readline()
             if not line:
                 break
-            line = line.strip()
+            lines.append(line.strip())
+            if len(lines) == args.batch_size:
+                write_batch(lines)
+                lines = []
+    if len(lines) > 0:
+        write_batch(lines)
+    output_file.close()
 
-            # m2_lines = error_generator.get_m2_edits_text(line, annotator, aspell_speller)
-            # with open(output_path, "a+") as output_file:
-            #     output_file.write("S " + line + "\n")
-            #     for m2_line in m2_lines:
-            #         output_file.write(m2_line + "\n")
-            #     output_file.write("\n")
 
-            error_line = error_generator.create_error_sentence(line, aspell_speller, True, True)
-            with open(output_path, "a+") as output_file:
-                output_file.write(error_line + "\n")
+def create_m2(args):
+    # Writes M2 (and TSV) by pool of processes, input is split into chunks of chunk_size lines.
+    input_path = args.input
+    output_path = args.output
+    tsv_path = args.tsv
+
+    offsets = line_index.get_line_offsets(input_path)
+    num_lines = len(offsets) - 1
+    arguments = [(chunk, input_path, start, min(start + args.chunk_size, num_lines), output_path, tsv_path, args.batch_size, args.seed)
+                 for chunk, start in enumerate(range(0, num_lines, args.chunk_size))]
+
+    m2_writer = open(output_path, 'wb')
+    tsv_writer = open(tsv_path, 'wb') if tsv_path else None
+    with Pool(args.num_processes, initializer=_init_worker, initargs=(args.lang, args.suggestions, args.batch_size)) as pool:
+        finished = set()
+        next_chunk = 0
+        for chunk in pool.imap_unordered(_create_m2_part, arguments):
+            finished.add(chunk)
+            # parts are appended in order of chunks
+            while next_chunk in finished:
+                _append_part(m2_writer, output_path, next_chunk)
+                if tsv_writer is not None:
+                    _append_part(tsv_writer, tsv_path, next_chunk)
+                finished.remove(next_chunk)
+                next_chunk += 1
+            print(f"{next_chunk}/{len(arguments)} chunks written")
+    m2_writer.close()
+    if tsv_writer is not None:
+        tsv_writer.close()
+
+
+def main(args):
+    if args.m2:
+        create_m2(args)
+    else:
+        create_error_lines(args)
 
 
 if __name__ == "__main__":
@@ -466,6 +743,13 @@ if __name__ == "__main__":
     parser.add_argument('-i', '--input', type=str)
     parser.add_argument('-o', '--output', type=str, default="output.m2")
     parser.add_argument('-l', '--lang', type=str)
+    parser.add_argument('-s', '--suggestions', type=str, default=None, help="Table of aspell suggestions (create_suggestion_table.py).")
+    parser.add_argument('-b', '--batch-size', type=int, default=256, help="Number of sentences parsed together by nlp.pipe.")
+    parser.add_argument('-n', '--num-processes', type=int, default=1, help="Number of processes of nlp.pipe (with --m2 number of processes of pool).")
+    parser.add_argument('--m2', action='store_true', help="Write M2 file with edits instead of lines with errors.")
+    parser.add_argument('-c', '--chunk-size', type=int, default=10_000, help="Number of lines processed by process at once (with --m2).")
+    parser.add_argument('-t', '--tsv', type=str, default=None, help="Output of pairs \"correct_sentence\\terror_sentence\" (TSV, with --m2).")
+    parser.add_argument('--seed', type=int, default=42)
 
     args = parser.parse_args()
     main(args)
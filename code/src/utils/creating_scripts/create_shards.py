@@ -0,0 +1,66 @@
+import sys
+sys.path.append('../..')
+
+import time
+import argparse
+
+from transformers import AutoTokenizer
+
+from utils import token_shards
+
+# Converts TSV files with lines "correct\toriginal" (files used with "errors_from_file": true) into pre-tokenized shards,
+# training reads them by setting "shards_dir" in config.
+
+
+def write_batch(writer: token_shards.ShardWriter, tokenizer, max_length: int, error_lines, lines):
+    tokenized = tokenizer(error_lines, text_target=lines, max_length=max_length, truncation=True)
+    for i, (error_line, line) in enumerate(zip(error_lines, lines)):
+        writer.write(tokenized['input_ids'][i], tokenized['labels'][i], error_line, line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", required=True, nargs='+', help="TSV files.")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--tokenizer", required=True)
+    parser.add_argument("--max-length", type=int, default=128)
+    parser.add_argument("--shard-size", type=int, default=token_shards.DEFAULT_SHARD_SIZE)
+    parser.add_argument("--batch-size", type=int, default=1024, help="Number of lines tokenized at once.")
+    parser.add_argument("--no-text", action="store_true", help="Do not store raw text.")
+    parser.add_argument("--reverted", action="store_true", help="Swap correct and original sentence (reverted pipeline).")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    writer = token_shards.ShardWriter(args.output_dir, "shard", args.shard_size, not args.no_text,
+                                      metadata={"tokenizer": args.tokenizer, "max_length": args.max_length})
+
+    start = time.perf_counter()
+    error_lines, lines = [], []
+    for filename in args.input:
+        with open(filename) as reader:
+            for line in reader:
+                line = line.rstrip('\n')
+                try:
+                    line, error_line = line.split('\t', 1)
+                except ValueError:
+                    print(f"skip line: {line}")
+                    continue
+                if args.reverted:
+                    line, error_line = error_line, line
+                error_lines.append(error_line)
+                lines.append(line)
+
+                if len(lines) == args.batch_size:
+                    write_batch(writer, tokenizer, args.max_length, error_lines, lines)
+                    error_lines, lines = [], []
+    if len(lines) > 0:
+        write_batch(writer, tokenizer, args.max_length, error_lines, lines)
+    writer.close()
+
+    print(f"{writer.num_examples} examples stored into {writer.num_shards} shards ({time.perf_counter() - start:.0f} s).")
+
+
+if __name__ == "__main__":
+    main()
+
+# CMD: python3 create_shards.py --input ../../../data/geccc/train/sentence.tsv --output-dir ../../../data/shards/geccc/ --tokenizer ../../../models/tokenizer/
@@ -0,0 +1,57 @@
+import sys
+sys.path.append('../..')
+
+import time
+import argparse
+import aspell
+
+from multiprocessing import Pool
+
+from utils import aspell_cache
+from utils.introduce_errors import get_token_vocabulary
+
+# Creates table with top-10 aspell suggestions for every alphabetic token of token file,
+# the table is used by data loading instead of live aspell (see "aspell_suggestions_file" in config).
+
+CHUNK_SIZE = 1000
+
+_aspell_speller = None
+
+
+def _init_speller(lang: str):
+    global _aspell_speller
+    _aspell_speller = aspell.Speller('lang', lang)
+
+
+def _suggest(tokens):
+    return [(token, _aspell_speller.suggest(token)[:aspell_cache.MAX_SUGGESTIONS]) for token in tokens]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--token-file", required=True, help="TSV file with tokens and frequencies.")
+    parser.add_argument("--output", required=True, help="Output table.")
+    parser.add_argument("--lang", default="cs", help="Language identifier for ASpell.")
+    parser.add_argument("--num-processes", type=int, default=None, help="Number of processes (default: all cores).")
+    args = parser.parse_args()
+
+    tokens = list(dict.fromkeys(get_token_vocabulary(args.token_file)))
+    chunks = [tokens[i:i + CHUNK_SIZE] for i in range(0, len(tokens), CHUNK_SIZE)]
+    print(f"Tokens: {len(tokens)}")
+
+    start = time.perf_counter()
+    suggestions = {}
+    with Pool(args.num_processes, initializer=_init_speller, initargs=(args.lang, )) as pool:
+        for i, chunk_suggestions in enumerate(pool.imap_unordered(_suggest, chunks)):
+            suggestions.update(chunk_suggestions)
+            if (i + 1) % 100 == 0:
+                print(f"{len(suggestions)} tokens done ({time.perf_counter() - start:.0f} s)")
+
+    aspell_cache.write_suggestion_table(args.output, suggestions)
+    print(f"Table with {len(suggestions)} tokens stored into {args.output} ({time.perf_counter() - start:.0f} s).")
+
+
+if __name__ == "__main__":
+    main()
+
+# CMD: python3 create_suggestion_table.py --token-file ../../../data/vocabluraries/vocabulary_cs.tsv --output ../../../data/vocabluraries/suggestions_cs.table
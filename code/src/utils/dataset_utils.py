@@ -1,6 +1,9 @@
+import numpy as np
 import tensorflow as tf
 from transformers.tf_utils import shape_list
 
+from . import token_shards
+
 ###
 #
 # There are two possible types of model: T5 and Bart from scratch (Bart-mine)
@@ -78,4 +81,152 @@ def _shift_right_t5(input_ids):
     # Make sure the assertion op is called by wrapping the result in an identity no-op
     with tf.control_dependencies([assert_gte0]):
         shifted_input_ids = tf.identity(shifted_input_ids)
-    return shifted_input_ids
\ No newline at end of file
+    return shifted_input_ids
+
+def create_sorted_batches(input_ids, max_tokens: int, pad_token_id: int = 0, max_batch_size: int = None):
+    '''
+    Creates batches for generation from tokenized sentences (list of lists of ids): sentences are sorted
+    by length (the longest first) and every batch has at most max_tokens tokens including padding.
+    Every batch is dict with padded input_ids, attention_mask and indices of its sentences in input_ids,
+    so original order can be restored after generation.
+    '''
+    order = sorted(range(len(input_ids)), key=lambda i: -len(input_ids[i]))
+    batches = []
+    start = 0
+    while start < len(order):
+        # sentences are sorted, the first one is the longest in batch
+        max_length = max(len(input_ids[order[start]]), 1)
+        size = max(max_tokens // max_length, 1)
+        if max_batch_size:
+            size = min(size, max_batch_size)
+        indices = order[start:start + size]
+
+        batch_input_ids = np.full((len(indices), max_length), pad_token_id, dtype=np.int32)
+        attention_mask = np.zeros((len(indices), max_length), dtype=np.int32)
+        for row, i in enumerate(indices):
+            batch_input_ids[row, :len(input_ids[i])] = input_ids[i]
+            attention_mask[row, :len(input_ids[i])] = 1
+        batches.append({
+            "input_ids": batch_input_ids,
+            "attention_mask": attention_mask,
+            "indices": np.array(indices, dtype=np.int64),
+        })
+        start += size
+    return batches
+
+def create_batches(input_ids, batch_size: int, pad_token_id: int = 0):
+    '''
+    Creates batches of batch_size tokenized sentences in original order (same format as create_sorted_batches
+    without indices), they are created once and reused for every generation.
+    '''
+    batches = []
+    for start in range(0, len(input_ids), batch_size):
+        batch = input_ids[start:start + batch_size]
+        max_length = max(max(len(ids) for ids in batch), 1)
+        batch_input_ids = np.full((len(batch), max_length), pad_token_id, dtype=np.int32)
+        attention_mask = np.zeros((len(batch), max_length), dtype=np.int32)
+        for row, ids in enumerate(batch):
+            batch_input_ids[row, :len(ids)] = ids
+            attention_mask[row, :len(ids)] = 1
+        batches.append({
+            "input_ids": batch_input_ids,
+            "attention_mask": attention_mask,
+        })
+    return batches
+
+###
+#
+# Dataset from pre-tokenized shards (see token_shards), it is used instead of data loading processes.
+#   - create_shard_dataset - shards are read in parallel by interleave (one example from every shard by round robin),
+#                            order is deterministic and reading can start at any example (start_example),
+#                            the dataset is infinite (epoch over all shards after epoch)
+#   - get_shards_resume_example - number of examples read before restored epoch (from backup of MyBackupAndRestore),
+#                            steps have different batch sizes (bucket_by_sequence_length), so number of examples
+#                            per step is estimated from lengths of examples in shards
+###
+
+SHARD_OUTPUT_SIGNATURE = {
+    "input_ids": tf.TensorSpec(shape=(None, ), dtype=tf.int32),
+    "attention_mask": tf.TensorSpec(shape=(None, ), dtype=tf.int32),
+    "tokenized_target_line": tf.TensorSpec(shape=(None, ), dtype=tf.int32),
+    "original_sentence": tf.TensorSpec(shape=(), dtype=tf.string),
+    "correct_sentence": tf.TensorSpec(shape=(), dtype=tf.string),
+}
+
+def create_shard_dataset(directory: str, seed: int, start_example: int = 0):
+    shards = [token_shards.Shard(path) for path in token_shards.get_shard_paths(directory)]
+    if len(shards) == 0:
+        raise ValueError(f"There are no shards in {directory}.")
+    shard_order = token_shards.get_shard_order(len(shards), seed)
+    lengths = [len(shards[shard]) for shard in shard_order]
+    num_examples = sum(lengths)
+    print(f"Shards: {len(shards)}, examples: {num_examples}")
+
+    def shard_generator(shard_index, epoch, position):
+        shard = shards[shard_index]
+        order = token_shards.get_example_order(len(shard), seed, epoch, shard_index)
+        for i in order[position:]:
+            yield shard.get(i)
+
+    def epoch_dataset(epoch, shard_order, positions):
+        dataset = tf.data.Dataset.from_tensor_slices((shard_order, positions))
+        return dataset.interleave(
+            lambda shard, position: tf.data.Dataset.from_generator(
+                shard_generator, output_signature=SHARD_OUTPUT_SIGNATURE, args=(shard, epoch, position)),
+            cycle_length=len(shard_order),
+            block_length=1,
+            num_parallel_calls=tf.data.experimental.AUTOTUNE,
+            deterministic=True)
+
+    # rest of the first epoch, round robin starts from shard that is read next
+    start_epoch = start_example // num_examples
+    positions, next_shard = token_shards.get_resume_positions(lengths, start_example)
+    first_shard_order = np.roll(shard_order, -next_shard)
+    first_positions = np.roll(positions, -next_shard)
+    dataset = epoch_dataset(start_epoch, first_shard_order, first_positions)
+
+    # following epochs
+    next_epochs = tf.data.Dataset.range(start_epoch + 1, np.iinfo(np.int64).max)
+    next_epochs = next_epochs.flat_map(lambda epoch: epoch_dataset(epoch, shard_order, np.zeros(len(shards), dtype=np.int64)))
+    return dataset.concatenate(next_epochs)
+
+def get_saved_epoch(backup_dir: str) -> int:
+    # Epoch stored in the latest backup (see MyBackupAndRestore), 0 if there is no backup.
+    checkpoint_path = tf.train.latest_checkpoint(backup_dir) if backup_dir else None
+    if checkpoint_path is None:
+        return 0
+    return int(tf.train.load_variable(checkpoint_path, "ckpt_saved_epoch/.ATTRIBUTES/VARIABLE_VALUE"))
+
+def get_examples_per_step(directory: str, bucket_boundaries, bucket_batch_sizes, max_examples: int = 100_000) -> float:
+    # Expected number of examples in batch of bucket_by_sequence_length: 1 / sum(p_bucket / batch_size_bucket),
+    # probabilities of buckets are estimated from at most max_examples examples of shards.
+    lengths = []
+    num_examples = 0
+    for path in token_shards.get_shard_paths(directory):
+        if num_examples >= max_examples:
+            break
+        shard = token_shards.Shard(path)
+        if len(shard) == 0:
+            continue
+        index = np.memmap(path + '.index', dtype=np.uint64, mode='r').reshape(-1, token_shards.INDEX_COLUMNS)
+        count = min(len(shard), max_examples - num_examples)
+        lengths.append(np.diff(index[:count + 1, 0].astype(np.int64)))
+        num_examples += count
+    if num_examples == 0:
+        return float(bucket_batch_sizes[0])
+    buckets = np.searchsorted(bucket_boundaries, np.concatenate(lengths), side='right')
+    probabilities = np.bincount(buckets, minlength=len(bucket_batch_sizes)) / num_examples
+    return 1.0 / float(np.sum(probabilities / np.asarray(bucket_batch_sizes, dtype=np.float64)))
+
+def get_shards_resume_example(directory: str, backup_dir: str, steps_per_epoch: int, bucket_boundaries, bucket_batch_sizes) -> int:
+    # Number of examples read before the restored epoch: initial_epoch * steps_per_epoch * examples per step.
+    initial_epoch = get_saved_epoch(backup_dir)
+    if initial_epoch == 0:
+        return 0
+    if not steps_per_epoch:
+        print("Shards are read from the start, resume position is not known without steps_per_epoch.")
+        return 0
+    examples_per_step = get_examples_per_step(directory, bucket_boundaries, bucket_batch_sizes)
+    start_example = int(round(initial_epoch * steps_per_epoch * examples_per_step))
+    print(f"Resume shards from example {start_example} (epoch {initial_epoch}, {examples_per_step:.1f} examples per step)")
+    return start_example
@@ -53,4 +53,61 @@ class Edit:
         orig = "Orig: "+str([self.o_start, self.o_end, self.o_str])
         cor = "Cor: "+str([self.c_start, self.c_end, self.c_str])
         type = "Type: "+repr(self.type)
-        return ", ".join([orig, cor, type])
\ No newline at end of file
+        return ", ".join([orig, cor, type])
+
+
+# Compact edit for generating of errors: only offsets, id of correction string in StringTable and type
+class EditRecord:
+    __slots__ = ('o_start', 'o_end', 'c_start', 'c_end', 'c_str_id', 'type')
+
+    def __init__(self, o_start, o_end, c_start, c_end, c_str_id, type="NA"):
+        self.o_start = o_start
+        self.o_end = o_end
+        self.c_start = c_start
+        self.c_end = c_end
+        self.c_str_id = c_str_id
+        self.type = type
+
+    # Input 1: An original text parsed by spacy
+    # Input 2: StringTable with correction string of this edit
+    # Input 3: Function that creates spacy Doc from correction string
+    # Output: ERRANT Edit (e.g. for M2 output by to_m2)
+    def to_edit(self, o_doc, strings, make_doc):
+        c_toks = make_doc(strings[self.c_str_id])
+        return Edit(o_doc[self.o_start:self.o_end], c_toks, [self.o_start, self.o_end, self.c_start, self.c_end], type=self.type)
+
+
+# Correction strings of EditRecords, every string is stored only once
+class StringTable:
+    def __init__(self):
+        self.strings = []
+        self._ids = {}
+
+    # Output: An id of string
+    def add(self, string):
+        string_id = self._ids.get(string, None)
+        if string_id is None:
+            string_id = len(self.strings)
+            self._ids[string] = string_id
+            self.strings.append(string)
+        return string_id
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+
+# Input 1: Tokens (strings) of original sentence
+# Input 2: EditRecords sorted by (o_start, o_end) without overlaps
+# Input 3: StringTable with correction strings of edits
+# Output: Sentence with applied edits, tokens are joined by space
+def apply_edits(tokens, edits, strings):
+    output = []
+    position = 0
+    for edit in edits:
+        output.extend(tokens[position:edit.o_start])
+        c_str = strings[edit.c_str_id]
+        if c_str:
+            output.append(c_str)
+        position = max(position, edit.o_end)
+    output.extend(tokens[position:])
+    return " ".join(output)
@@ -0,0 +1,98 @@
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+
+from typing import List
+
+from m2scorer.m2scorer import load_annotation
+
+###
+#
+# Cache of evaluation inputs (parsed M2 files and tokenized source sentences).
+#
+#   For every M2 file and tokenizer following files are stored in cache directory:
+#     <key>.annotations - pickled source sentences and gold edits (result of load_annotation),
+#     <key>.input_ids   - flat int32 array with input_ids of all source sentences,
+#     <key>.offsets     - int64 array (num_sentences + 1) with start offsets of sentences in input_ids,
+#     <key>.json        - metadata, it is written as the last file, so only entries with .json are complete.
+#   Key is hash of content of M2 file, tokenizer (name, class, vocabulary size) and max_length, so cache
+#   is invalidated by every change of data or tokenizer. Input_ids are memory-mapped, sentence is a view into the map.
+#
+###
+
+READ_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def get_file_hash(filename: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class EvalInputCache:
+    def __init__(self, cache_dir: str, tokenizer, tokenizer_name: str, max_length: int):
+        self.cache_dir = cache_dir
+        self.tokenizer = tokenizer
+        self.tokenizer_name = tokenizer_name
+        self.max_length = max_length
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key(self, m2_file: str) -> str:
+        content = repr((get_file_hash(m2_file), self.tokenizer_name, type(self.tokenizer).__name__,
+                        len(self.tokenizer), self.max_length))
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def _get_path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def _write(self, key: str, source_sentences: List[str], gold_edits: list, input_ids: List[List[int]]):
+        # Every file is written into temporary file first, metadata are written as the last file.
+        tmp_suffix = f".tmp-{os.getpid()}"
+        lengths = np.array([len(ids) for ids in input_ids], dtype=np.int64)
+        offsets = np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(lengths)])
+        flat_input_ids = np.fromiter((i for ids in input_ids for i in ids), dtype=np.int32, count=int(offsets[-1]))
+
+        with open(self._get_path(key, '.annotations' + tmp_suffix), 'wb') as f:
+            pickle.dump((source_sentences, gold_edits), f, protocol=pickle.HIGHEST_PROTOCOL)
+        flat_input_ids.tofile(self._get_path(key, '.input_ids' + tmp_suffix))
+        offsets.tofile(self._get_path(key, '.offsets' + tmp_suffix))
+        with open(self._get_path(key, '.json' + tmp_suffix), 'w') as json_file:
+            json.dump({"num_sentences": len(source_sentences), "num_tokens": int(offsets[-1]),
+                       "tokenizer": self.tokenizer_name, "max_length": self.max_length}, json_file)
+
+        for suffix in ['.annotations', '.input_ids', '.offsets', '.json']:
+            os.replace(self._get_path(key, suffix + tmp_suffix), self._get_path(key, suffix))
+
+    def _read(self, key: str):
+        with open(self._get_path(key, '.annotations'), 'rb') as f:
+            source_sentences, gold_edits = pickle.load(f)
+        offsets = np.fromfile(self._get_path(key, '.offsets'), dtype=np.int64)
+        # mmap of empty file is not possible
+        if offsets[-1] > 0:
+            flat_input_ids = np.memmap(self._get_path(key, '.input_ids'), dtype=np.int32, mode='r')
+        else:
+            flat_input_ids = np.zeros(0, dtype=np.int32)
+        input_ids = [flat_input_ids[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+        return source_sentences, gold_edits, input_ids
+
+    def load(self, m2_file: str):
+        '''
+        Returns source sentences, gold edits and input_ids of source sentences of M2 file,
+        M2 file is parsed and tokenized only if it is not in cache.
+        '''
+        key = self.get_key(m2_file)
+        if os.path.isfile(self._get_path(key, '.json')):
+            print(f"Evaluation inputs of {m2_file} loaded from cache.")
+            return self._read(key)
+
+        source_sentences, gold_edits = load_annotation(m2_file)
+        input_ids = self.tokenizer(source_sentences, max_length=self.max_length, truncation=True)['input_ids']
+        self._write(key, source_sentences, gold_edits, input_ids)
+        return self._read(key)
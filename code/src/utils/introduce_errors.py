@@ -14,6 +14,12 @@ czech_diacritics_tuples = [('a', 'á'), ('c', 'č'), ('d', 'ď'), ('e', 'é', '
 czech_diacritizables_chars = [char for sublist in czech_diacritics_tuples for char in sublist] + [char.upper() for sublist in
                                                                                                   czech_diacritics_tuples for char in
                                                                                                   sublist]
+# char -> its diacritics group (in same case as char)
+czech_diacritics_groups = {char: group for group in czech_diacritics_tuples for char in group}
+czech_diacritics_groups.update({char.upper(): tuple(c.upper() for c in group) for group in czech_diacritics_tuples for char in group})
+
+TOKEN_OPERATIONS = ['replace', 'insert', 'delete', 'swap', 'recase']
+CHAR_OPERATIONS = ['replace', 'insert', 'delete', 'swap', 'change_diacritics']
 
 
 def get_char_vocabulary(lang):
@@ -127,59 +133,128 @@ def introduce_token_level_errors_on_sentence(tokens, replace_prob, insert_prob,
     return new_sentence
 
 
+def introduce_token_level_errors_on_sentences(sentences_tokens, replace_prob, insert_prob, delete_prob, swap_prob, recase_prob, err_prob,
+                                              std_dev, word_vocabulary, aspell_speller):
+    # Batch version of introduce_token_level_errors_on_sentence (same distribution of output sentences).
+    # Numbers of errors, positions, operations and inserted words are drawn for all sentences at once,
+    # only replace (aspell) and recase are done per token.
+    lengths = np.array([len(tokens) for tokens in sentences_tokens], dtype=np.int64)
+    num_errors = np.round(np.random.normal(err_prob, std_dev, size=len(lengths)) * lengths).astype(np.int64)
+    num_errors = np.clip(num_errors, 0, lengths)  # num_errors \in [0; len(tokens)]
+
+    new_sentences_tokens = [list(tokens) for tokens in sentences_tokens]
+    total_errors = int(num_errors.sum())
+    if total_errors == 0:
+        return [' '.join(tokens) for tokens in new_sentences_tokens]
+
+    # positions: every token gets random key, tokens with num_errors smallest keys of its sentence are modified
+    sentence_ids = np.repeat(np.arange(len(lengths)), lengths)
+    sentence_starts = np.cumsum(lengths) - lengths
+    order = np.lexsort((np.random.random(len(sentence_ids)), sentence_ids))
+    ranks = np.arange(len(order)) - sentence_starts[sentence_ids[order]]
+    token_ids_to_modify = np.sort(order[ranks < num_errors[sentence_ids[order]]])
+
+    operations = np.random.choice(len(TOKEN_OPERATIONS), total_errors, p=[replace_prob, insert_prob, delete_prob, swap_prob, recase_prob])
+    vocabulary_ids = np.random.randint(len(word_vocabulary), size=total_errors)
+
+    # modified tokens are joined by same rule as in the loop version (empty new token does not add space)
+    modified = [np.zeros(length, dtype=bool) for length in lengths.tolist()]
+    for global_id, operation, vocabulary_id in zip(token_ids_to_modify.tolist(), operations.tolist(), vocabulary_ids.tolist()):
+        sentence_id = sentence_ids[global_id]
+        tokens = new_sentences_tokens[sentence_id]
+        token_id = global_id - sentence_starts[sentence_id]
+        modified[sentence_id][token_id] = True
+        current_token = tokens[token_id]
+        operation = TOKEN_OPERATIONS[operation]
+
+        if operation == 'replace':
+            if current_token.isalpha():
+                proposals = aspell_speller.suggest(current_token)[:10]
+                if len(proposals) > 0:
+                    tokens[token_id] = proposals[np.random.randint(len(proposals))]
+        elif operation == 'insert':
+            tokens[token_id] = current_token + ' ' + word_vocabulary[vocabulary_id]
+        elif operation == 'delete':
+            if current_token.isalpha() and current_token not in allowed_source_delete_tokens:
+                tokens[token_id] = ''
+        elif operation == 'recase':
+            if not current_token.isalpha():
+                pass
+            elif current_token.islower():
+                tokens[token_id] = current_token[0].upper() + current_token[1:]
+            elif np.random.random() < 0.5:
+                tokens[token_id] = current_token.lower()
+            else:
+                num_recase = min(len(current_token), max(1, int(np.round(np.random.normal(0.3, 0.4) * len(current_token)))))
+                char_ids_to_recase = set(np.random.choice(len(current_token), num_recase, replace=False).tolist())
+                tokens[token_id] = ''.join((char.lower() if char.isupper() else char.upper()) if char_i in char_ids_to_recase else char
+                                           for char_i, char in enumerate(current_token))
+        elif operation == 'swap':
+            if token_id == len(tokens) - 1:
+                tokens[token_id] = ''
+            else:
+                tokens[token_id] = tokens[token_id + 1]
+                tokens[token_id + 1] = current_token
+
+    new_sentences = []
+    for tokens, tokens_modified, sentence_num_errors in zip(new_sentences_tokens, modified, num_errors.tolist()):
+        if sentence_num_errors == 0:
+            new_sentences.append(' '.join(tokens))
+            continue
+        new_sentence = ''
+        for token, token_modified in zip(tokens, tokens_modified.tolist()):
+            if new_sentence and (token or not token_modified):
+                new_sentence += ' '
+            new_sentence += token
+        new_sentences.append(new_sentence)
+    return new_sentences
+
+
 def introduce_char_level_errors_on_sentence(sentence, replace_prob, insert_prob, delete_prob, swap_prob, change_diacritics_prob, err_prob,
                                             std_dev, char_vocabulary):
-    sentence = list(sentence)
+    # All random values are drawn at once for the whole sentence and only selected chars are visited,
+    # the output distribution is same as the distribution of introduce_errors_v2.introduce_char_level_errors_on_sentence.
     num_errors = int(np.round(np.random.normal(err_prob, std_dev) * len(sentence)))
     num_errors = min(max(0, num_errors), len(sentence))  # num_errors \in [0; len(sentence)]
 
     if num_errors == 0:
-        return ''.join(sentence)
+        return sentence
 
-    char_ids_to_modify = np.random.choice(len(sentence), num_errors, replace=False)
-
-    new_sentence = ''
-    for char_id in range(len(sentence)):
-        if char_id not in char_ids_to_modify:
-            new_sentence += sentence[char_id]
-            continue
-
-        operation = np.random.choice(['replace', 'insert', 'delete', 'swap', 'change_diacritics'], 1,
-                                     p=[replace_prob, insert_prob, delete_prob, swap_prob, change_diacritics_prob])
+    char_ids_to_modify = np.sort(np.random.choice(len(sentence), num_errors, replace=False))
+    operations = np.random.choice(len(CHAR_OPERATIONS), num_errors,
+                                  p=[replace_prob, insert_prob, delete_prob, swap_prob, change_diacritics_prob])
+    vocabulary_ids = np.random.randint(len(char_vocabulary), size=num_errors)
+    diacritics_draws = np.random.random(num_errors)
 
+    # chars are changed in place, swap moves current char to the next position (same as in the loop version)
+    sentence = list(sentence)
+    last_char_id = len(sentence) - 1
+    for char_id, operation, vocabulary_id, diacritics_draw in zip(char_ids_to_modify.tolist(), operations.tolist(),
+                                                                 vocabulary_ids.tolist(), diacritics_draws.tolist()):
         current_char = sentence[char_id]
-        new_char = ''
+        operation = CHAR_OPERATIONS[operation]
         if operation == 'replace':
             if current_char.isalpha():
-                new_char = np.random.choice(char_vocabulary)
-            else:
-                new_char = current_char
+                sentence[char_id] = char_vocabulary[vocabulary_id]
         elif operation == 'insert':
-            new_char = current_char + ' ' + np.random.choice(char_vocabulary)
+            sentence[char_id] = current_char + ' ' + char_vocabulary[vocabulary_id]
         elif operation == 'delete':
             if current_char.isalpha():
-                new_char = ''
-            else:
-                new_char = current_char
+                sentence[char_id] = ''
         elif operation == 'swap':
-            if char_id == len(sentence) - 1:
-                continue
-
-            new_char = sentence[char_id + 1]
-            sentence[char_id + 1] = sentence[char_id]
+            if char_id == last_char_id:
+                sentence[char_id] = ''
+            else:
+                sentence[char_id] = sentence[char_id + 1]
+                sentence[char_id + 1] = current_char
         elif operation == 'change_diacritics':
-            if current_char in czech_diacritizables_chars:
-                is_lower = current_char.islower()
-                current_char = current_char.lower()
-                char_diacr_group = [group for group in czech_diacritics_tuples if current_char in group][0]
-                new_char = np.random.choice(char_diacr_group)
-
-                if not is_lower:
-                    new_char = new_char.upper()
-
-        new_sentence += new_char
+            char_diacr_group = czech_diacritics_groups.get(current_char, None)
+            if char_diacr_group is not None:
+                sentence[char_id] = char_diacr_group[int(diacritics_draw * len(char_diacr_group))]
+            else:
+                sentence[char_id] = ''
 
-    return new_sentence
+    return ''.join(sentence)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,165 @@
+import os
+import json
+import numpy as np
+
+###
+#
+# Sidecar line index for large text corpora.
+#
+#   For every data file a "<filename>.offsets" file is stored next to it. It is a flat uint64 array:
+#     [file size, file mtime (ns), offset of line 0, offset of line 1, ..., offset of line N-1, file size]
+#   so a reader can seek directly to the first byte of any line instead of calling readline() from the start.
+#   The index is rebuilt automatically when size or mtime of the data file change.
+#
+#   Besides the index, "<filename>.meta.json" stores metadata (number of lines, size, mtime), so the number
+#   of lines is computed only once and reused across passes over data and across restarts.
+#
+###
+
+INDEX_SUFFIX = '.offsets'
+METADATA_SUFFIX = '.meta.json'
+HEADER_LENGTH = 2 # file size, file mtime
+READ_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def get_index_path(filename: str) -> str:
+    return filename + INDEX_SUFFIX
+
+
+def build_line_offsets(filename: str) -> np.ndarray:
+    # Returns offsets of line starts, the last item is the file size (end of the last line).
+    parts = [np.zeros(1, dtype=np.uint64)]
+    position = 0
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+            parts.append((newlines + position + 1).astype(np.uint64))
+            position += len(block)
+    offsets = np.concatenate(parts)
+    if offsets[-1] != position:
+        # last line does not end with newline
+        offsets = np.append(offsets, np.uint64(position))
+    return offsets
+
+
+def write_line_index(filename: str, offsets: np.ndarray, stat: os.stat_result):
+    # Writes into temporary file first, so readers never see half-written index.
+    index_path = get_index_path(filename)
+    tmp_path = f"{index_path}.tmp-{os.getpid()}"
+    header = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.uint64)
+    with open(tmp_path, 'wb') as f:
+        header.tofile(f)
+        offsets.astype(np.uint64).tofile(f)
+    os.replace(tmp_path, index_path)
+
+
+def load_line_index(filename: str):
+    # Returns memory-mapped offsets or None if index is missing or stale.
+    index_path = get_index_path(filename)
+    if not os.path.isfile(index_path):
+        return None
+    stat = os.stat(filename)
+    header = np.fromfile(index_path, dtype=np.uint64, count=HEADER_LENGTH)
+    if len(header) != HEADER_LENGTH or header[0] != stat.st_size or header[1] != stat.st_mtime_ns:
+        return None
+    if os.path.getsize(index_path) <= HEADER_LENGTH * 8:
+        return None
+    return np.memmap(index_path, dtype=np.uint64, mode='r', offset=HEADER_LENGTH * 8)
+
+
+def get_line_offsets(filename: str) -> np.ndarray:
+    # Loads valid index or builds (and stores) new one.
+    offsets = load_line_index(filename)
+    if offsets is not None:
+        return offsets
+
+    stat = os.stat(filename)
+    offsets = build_line_offsets(filename)
+    try:
+        write_line_index(filename, offsets, stat)
+    except OSError as e:
+        print(e)
+        print(f"Line index for {filename} is not stored.")
+    return offsets
+
+
+_metadata_cache = {}
+
+
+def get_metadata_path(filename: str) -> str:
+    return filename + METADATA_SUFFIX
+
+
+def count_lines(filename: str) -> int:
+    # Counts lines same way as enumerate(f) does (last line does not have to end with newline).
+    num_lines = 0
+    last_byte = b'\n'
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            num_lines += block.count(b'\n')
+            last_byte = block[-1:]
+    if last_byte != b'\n':
+        num_lines += 1
+    return num_lines
+
+
+def _is_valid_metadata(metadata, stat: os.stat_result) -> bool:
+    return metadata is not None and metadata.get('size') == stat.st_size and metadata.get('mtime_ns') == stat.st_mtime_ns
+
+
+def _load_metadata(filename: str):
+    try:
+        with open(get_metadata_path(filename)) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_metadata(filename: str, metadata: dict):
+    metadata_path = get_metadata_path(filename)
+    tmp_path = f"{metadata_path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp_path, 'w') as json_file:
+            json.dump(metadata, json_file)
+        os.replace(tmp_path, metadata_path)
+    except OSError as e:
+        print(e)
+        print(f"Metadata for {filename} are not stored.")
+
+
+def get_file_metadata(filename: str, build_index: bool = False) -> dict:
+    '''
+    Returns dict with number of lines ("num_lines"), size in bytes ("size") and mtime ("mtime_ns") of file.
+    Metadata are cached in memory and in sidecar file and they are recomputed only if file changes.
+    If build_index is set, line index is built (or validated) too and lines are counted from it.
+    '''
+    stat = os.stat(filename)
+    key = os.path.abspath(filename)
+
+    metadata = _metadata_cache.get(key)
+    if not _is_valid_metadata(metadata, stat):
+        metadata = _load_metadata(filename)
+    if not _is_valid_metadata(metadata, stat):
+        offsets = get_line_offsets(filename) if build_index else load_line_index(filename)
+        num_lines = len(offsets) - 1 if offsets is not None else count_lines(filename)
+        metadata = {
+            "num_lines": num_lines,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+        _write_metadata(filename, metadata)
+    elif build_index:
+        get_line_offsets(filename)
+
+    _metadata_cache[key] = metadata
+    return metadata
+
+
+def get_num_lines(filename: str) -> int:
+    return get_file_metadata(filename)['num_lines']
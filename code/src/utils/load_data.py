@@ -1,11 +1,18 @@
 from multiprocessing import Queue
 from typing import List
+import os
+import time
 import random
+import shutil
+import numpy as np
 from . import introduce_errors
 from . import create_errors
+from . import line_index
+from . import aspell_cache
+from . import token_shards
 # import introduce_errors
 import aspell
-from multiprocessing import Pool
+from multiprocessing import Pool, Value
 import errant
 
 # import dataset_utils 
@@ -27,39 +34,157 @@ class GenereteErrorLine():
         self.char_std_dev = char_std_dev
 
     def __call__(self, line, aspell_speller):
+        return self.create_error_lines([line], aspell_speller)[0]
+
+    def create_error_lines(self, lines: List[str], aspell_speller) -> List[str]:
+        # Token-level errors are introduced into all lines at once (same distribution as introduce_token_level_errors_on_sentence).
         token_replace_prob, token_insert_prob, token_delete_prob, token_swap_prob, recase_prob = self.token_err_distribution
         char_replace_prob, char_insert_prob, char_delete_prob, char_swap_prob, change_diacritics_prob = self.char_err_distribution
-        line = line.strip('\n')
+        lines = [line.strip('\n') for line in lines]
         
         # introduce word-level errors
-        line = introduce_errors.introduce_token_level_errors_on_sentence(line.split(' '), token_replace_prob, token_insert_prob, token_delete_prob,
+        lines = introduce_errors.introduce_token_level_errors_on_sentences([line.split(' ') for line in lines], 
+                                                        token_replace_prob, token_insert_prob, token_delete_prob,
                                                         token_swap_prob, recase_prob, float(self.token_err_prob), float(self.token_std_dev),
                                                         self.tokens, aspell_speller)
-        if '\t' in line or '\n' in line:
-            raise ValueError('!!! Error !!! ' + line)
+        for line in lines:
+            if '\t' in line or '\n' in line:
+                raise ValueError('!!! Error !!! ' + line)
         # introduce spelling errors
-        line = introduce_errors.introduce_char_level_errors_on_sentence(line, char_replace_prob, char_insert_prob, char_delete_prob, char_swap_prob,
+        lines = [introduce_errors.introduce_char_level_errors_on_sentence(line, char_replace_prob, char_insert_prob, char_delete_prob, char_swap_prob,
                                                        change_diacritics_prob, float(self.char_err_prob), float(self.char_std_dev),
-                                                       self.characters)
-        return line
+                                                       self.characters) for line in lines]
+        return lines
     
 
+def get_aspell_speller(lang: str, aspell_cache_size: int = 0, aspell_suggestions_file: str = None):
+    # Returns aspell.Speller, it is wrapped by CachedSpeller if cache or table of suggestions is used.
+    # With table, aspell.Speller is created only when some token is not in table.
+    if aspell_suggestions_file:
+        table = aspell_cache.SuggestionTable(aspell_suggestions_file)
+        return aspell_cache.CachedSpeller(aspell_cache.LazySpeller(lang), aspell_cache_size, table)
+
+    aspell_speller = aspell.Speller('lang', lang)
+    if aspell_cache_size > 0:
+        aspell_speller = aspell_cache.CachedSpeller(aspell_speller, aspell_cache_size)
+    return aspell_speller
+
+
+def create_error_pairs(gel: GenereteErrorLine, lines: List[str], aspell_speller) -> List[tuple]:
+    # Returns pairs (line, error_line), errors are created for all lines at once,
+    # if it fails, lines are processed one by one and only wrong lines are skipped.
+    try:
+        return list(zip(lines, gel.create_error_lines(lines, aspell_speller)))
+    except Exception:
+        pairs = []
+        for line in lines:
+            try:
+                pairs.append((line, gel(line, aspell_speller)))
+            except Exception as e:
+                print(e)
+                print(f"skip line: {line}")
+        return pairs
+
+
+_worker_queue = None
+
+
+def _init_worker(queue):
+    # Queue is given to every process of pool at its start, because SharedMemoryQueue
+    # (and its locks) cannot be pickled as argument of starmap.
+    global _worker_queue
+    _worker_queue = queue
+
+
+def tokenize_and_put(queue, tokenizer, max_length, error_lines: List[str], lines: List[str]) -> int:
+    # Tokenizes all pairs by one call of tokenizer (fast tokenizer processes them in parallel),
+    # splits the result into examples and puts them into queue.
+    # Example that does not fit into queue (too long sentence for SharedMemoryQueue) is skipped,
+    # number of skipped examples is returned.
+    tokenized = tokenizer(error_lines, text_target=lines, max_length=max_length, truncation=True)
+
+    skipped = 0
+    for i, (error_line, line) in enumerate(zip(error_lines, lines)):
+        dato = {
+            "input_ids": np.array(tokenized['input_ids'][i], dtype=np.int32),
+            "attention_mask": np.array(tokenized['attention_mask'][i], dtype=np.int32),
+            "tokenized_target_line": np.array(tokenized['labels'][i], dtype=np.int32),
+            "original_sentence": error_line,
+            "correct_sentence": line,
+        }
+        try:
+            queue.put(dato)
+        except ValueError as e:
+            print(e)
+            skipped += 1
+    return skipped
+
+
 def data_loader(filename, queue, start_position, end_position, gel: GenereteErrorLine, tokenizer, max_length, errors_from_file: bool,
-                reverted_pipeline: bool, error_generator: create_errors.ErrorGenerator, lang: str):
+                reverted_pipeline: bool, error_generator: create_errors.ErrorGenerator, lang: str, tokenize_batch_size: int = 1,
+                aspell_cache_size: int = 0, aspell_suggestions_file: str = None):
     # Starts read from start to end position, line with mistake is created for every read line,
     # then these lines are tokenized and store into dict that is putted into queue.
+    # Errors by gel (or error_generator) are created and pairs are tokenized in batches of tokenize_batch_size lines.
+    # If queue is None, queue given by pool initializer is used.
+    if queue is None:
+        queue = _worker_queue
+
     counter = 0
     if not errors_from_file:
-        aspell_speller = aspell.Speller('lang', lang)
+        aspell_speller = get_aspell_speller(lang, aspell_cache_size, aspell_suggestions_file)
     
     if error_generator is not None:
         error_generator._init_annotator()
 
+    offsets = line_index.load_line_index(filename)
+
+    error_lines = []
+    lines = []
+    gel_lines = [] # lines waiting for errors from gel, they are created for whole batch at once
+    generator_lines = [] # lines waiting for error_generator, they are parsed together by nlp.pipe
+
+    def add_pair(line, error_line):
+        if reverted_pipeline:
+            error_line, line = line, error_line
+        error_lines.append(error_line)
+        lines.append(line)
+
+    def flush():
+        if len(gel_lines) > 0:
+            for line, error_line in create_error_pairs(gel, gel_lines, aspell_speller):
+                add_pair(line, error_line)
+            gel_lines.clear()
+
+        if len(generator_lines) > 0:
+            try:
+                error_lines_batch = error_generator.create_error_sentences(generator_lines, aspell_speller, True, True)
+                for line, error_line in zip(generator_lines, error_lines_batch):
+                    add_pair(line, error_line)
+            except Exception as e:
+                print(e)
+                print(f"skip {len(generator_lines)} lines")
+            generator_lines.clear()
+
+        try:
+            skipped = tokenize_and_put(queue, tokenizer, max_length, error_lines, lines)
+            if skipped > 0:
+                print(f"skip {skipped} lines")
+        except Exception as e:
+            print(e)
+            print(f"skip {len(lines)} lines")
+        error_lines.clear()
+        lines.clear()
+
     with open(filename, 'r') as f:
         # find start position
-        while counter != start_position:
-            f.readline()
-            counter += 1
+        if offsets is not None:
+            f.seek(int(offsets[start_position]))
+            counter = start_position
+        else:
+            while counter != start_position:
+                f.readline()
+                counter += 1
 
         # read until end position
         while counter != end_position:
@@ -69,49 +194,42 @@ def data_loader(filename, queue, start_position, end_position, gel: GenereteErro
             try:
                 if errors_from_file:
                     line, error_line = line.split('\t', 1)
+                    add_pair(line, error_line)
+                elif error_generator is not None:
+                    generator_lines.append(line)
                 else:
-                    if error_generator is not None:
-                        error_line = error_generator.create_error_sentence(line, aspell_speller, True, True)
-                    else:
-                        error_line = gel(line, aspell_speller)
-                    
-
-                if reverted_pipeline:
-                    error_line, line = line, error_line
-
-                tokenized = tokenizer(error_line, text_target=line, max_length=max_length, truncation=True, return_tensors="np")
-            
-                input_ids = tokenized['input_ids'][0]
-                attention_mask = tokenized['attention_mask'][0]
-                tokenized_target_line = tokenized['labels'][0]
-
-                dato = {
-                    "input_ids": input_ids,
-                    "attention_mask": attention_mask,
-                    "tokenized_target_line": tokenized_target_line,
-                    "original_sentence": error_line,
-                    "correct_sentence": line,
-                }
-            
-                queue.put(dato)
+                    gel_lines.append(line)
             except Exception as e:
                 print(e)
                 print(f"skip line: {line}")
 
+            if len(lines) + len(gel_lines) + len(generator_lines) >= tokenize_batch_size:
+                flush()
+
             counter += 1
 
             if not line: # EOF
                 f.seek(0) 
                 counter = 0
 
+    if len(lines) + len(gel_lines) + len(generator_lines) > 0:
+        flush()
+
+    if not errors_from_file and isinstance(aspell_speller, aspell_cache.CachedSpeller):
+        print(aspell_speller.get_stats())
+
 
 def process_file_in_chunks(
         queue: Queue, pool: Pool, num_parallel: int, filename: str, file_size: int, 
         gel: GenereteErrorLine, tokenizer, max_length, errors_from_file: bool, reverted_pipeline: bool,
-        error_generator: create_errors.ErrorGenerator, lang: str):
+        error_generator: create_errors.ErrorGenerator, lang: str, tokenize_batch_size: int = 1,
+        aspell_cache_size: int = 0, aspell_suggestions_file: str = None):
     # Computes start index and end index for every process, stores them as arguments,
     # runs these processes and wait until they finished.
     
+    # make sure that line index exists, so processes can seek directly to their start position
+    line_index.get_line_offsets(filename)
+
     start = random.randint(0, file_size-1)
     process_size = file_size // num_parallel
 
@@ -123,36 +241,183 @@ def process_file_in_chunks(
     for i in range(num_parallel):
         current = (current + process_size) % file_size
         end_position = current
-        arguments.append((filename, queue, start_position, end_position, gel, tokenizer, max_length, errors_from_file, reverted_pipeline, error_generator, lang,))
+        arguments.append((filename, None, start_position, end_position, gel, tokenizer, max_length, errors_from_file, reverted_pipeline, error_generator, lang, tokenize_batch_size,
+                          aspell_cache_size, aspell_suggestions_file,))
         start_position = current
     end_position = start
-    arguments.append((filename, queue, start_position, end_position, gel, tokenizer, max_length, errors_from_file, reverted_pipeline, error_generator, lang, ))
+    arguments.append((filename, None, start_position, end_position, gel, tokenizer, max_length, errors_from_file, reverted_pipeline, error_generator, lang, tokenize_batch_size,
+                      aspell_cache_size, aspell_suggestions_file, ))
 
     # start processes and wait until they finished
     pool.starmap(data_loader, arguments)
 
 
 def data_generator(queue: Queue, files: List[str], num_parallel: int, gel: GenereteErrorLine, tokenizer, max_length, errors_from_file: bool = False,
-                   reverted_pipeline: bool = False, error_generator: create_errors.ErrorGenerator = None, lang: str = "cs"):
+                   reverted_pipeline: bool = False, error_generator: create_errors.ErrorGenerator = None, lang: str = "cs",
+                   tokenize_batch_size: int = 1, aspell_cache_size: int = 0, aspell_suggestions_file: str = None):
     # Main methon that is used in pipeline.py
     # Creates pools and goes iteratively over files (one or more files).
     # Computes file size and run process_file_in_chunks. 
+    # Queue can be Manager().Queue or shm_queue.SharedMemoryQueue, it is handed over to processes by pool initializer.
     index = 0
-    pool = Pool(num_parallel)
+    pool = Pool(num_parallel, initializer=_init_worker, initargs=(queue, ))
 
     while True:
         file = files[index]
 
-        # get file size
-        with open(file, 'r') as f:
-            for count, _ in enumerate(f):
-                pass
-        file_size = count + 1
+        # get file size (number of lines), it is cached and recomputed only when file changes
+        file_size = line_index.get_file_metadata(file, build_index=True)['num_lines']
         
         process_file_in_chunks(
             queue, pool, num_parallel, file, file_size, gel, tokenizer, max_length, 
-            errors_from_file, reverted_pipeline, error_generator, lang)
+            errors_from_file, reverted_pipeline, error_generator, lang, tokenize_batch_size,
+            aspell_cache_size, aspell_suggestions_file)
 
         index += 1
         if index == len(files):
             index = 0
+
+
+###
+#
+# Fast creation of datasets with synthetic errors (create_dataset with "num_lines" in config).
+#
+#   There is no queue and no tf.data, every process of pool creates errors for its part of lines
+#   and writes them directly into its own output file by large buffered writes:
+#     - "tsv" format: "<output>.part-000", "<output>.part-001", ... with lines "correct\toriginal", parts are appended
+#       into <output> (same file as in create_dataset without num_lines) in order of parts and removed at the end,
+#     - "shards" format: shards "part-000-00000", ... in directory <output> (see token_shards).
+#   Every file is split into num_parts chunks (from random start, same as process_file_in_chunks does),
+#   part i reads i-th chunk of the first file, then i-th chunk of the next file etc. until it writes its number of lines.
+#   Processes share only counter of written lines, it is used for reporting of lines/sec.
+#
+###
+
+_progress = None
+
+
+def _init_progress(progress):
+    global _progress
+    _progress = progress
+
+
+def read_lines(filename: str, offsets, start_position: int, end_position: int):
+    # Yields lines from start_position to end_position (lines are numbered modulo number of lines of file).
+    num_lines = len(offsets) - 1
+    with open(filename, 'r') as f:
+        f.seek(int(offsets[start_position]))
+        counter = start_position
+        while counter != end_position:
+            line = f.readline()
+            yield line[:-1] if line.endswith("\n") else line
+            counter += 1
+            if counter == num_lines:
+                f.seek(0)
+                counter = 0
+
+
+def get_part_path(output: str, part: int) -> str:
+    return f"{output}.part-{part:03d}"
+
+
+def create_error_data_part(part: int, num_parts: int, files: List[str], file_starts: List[int], num_lines: int, output: str, 
+                           output_format: str, gel: GenereteErrorLine, lang: str, tokenizer=None, max_length: int = None, 
+                           batch_size: int = 1024, aspell_cache_size: int = 0, aspell_suggestions_file: str = None, seed: int = 42,
+                           shard_size: int = None, shard_store_text: bool = True) -> int:
+    # Creates num_lines pairs and writes them into output file of part, returns number of written lines.
+    np.random.seed(seed + part)
+    random.seed(seed + part)
+    aspell_speller = get_aspell_speller(lang, aspell_cache_size, aspell_suggestions_file)
+
+    if output_format == "shards":
+        writer = token_shards.ShardWriter(output, f"part-{part:03d}", shard_size or token_shards.DEFAULT_SHARD_SIZE, shard_store_text,
+                                          metadata={"tokenizer": tokenizer.name_or_path, "max_length": max_length})
+    else:
+        writer = open(get_part_path(output, part), 'w', buffering=16 * 1024 * 1024)
+
+    written = 0
+
+    def write_batch(lines):
+        nonlocal written
+        pairs = create_error_pairs(gel, lines, aspell_speller)[:num_lines - written]
+        if output_format == "shards":
+            error_lines = [error_line for _, error_line in pairs]
+            lines = [line for line, _ in pairs]
+            tokenized = tokenizer(error_lines, text_target=lines, max_length=max_length, truncation=True)
+            for i, (line, error_line) in enumerate(pairs):
+                writer.write(tokenized['input_ids'][i], tokenized['labels'][i], error_line, line)
+        else:
+            writer.write("".join(line + "\t" + error_line + "\n" for line, error_line in pairs))
+        written += len(pairs)
+        with _progress.get_lock():
+            _progress.value += len(pairs)
+
+    index = 0
+    while written < num_lines:
+        filename = files[index % len(files)]
+        offsets = line_index.get_line_offsets(filename)
+        file_size = len(offsets) - 1
+        start = file_starts[index % len(files)]
+        start_position = (start + part * file_size // num_parts) % file_size
+        end_position = (start + (part + 1) * file_size // num_parts) % file_size
+
+        lines = []
+        if start_position != end_position:
+            for line in read_lines(filename, offsets, start_position, end_position):
+                lines.append(line)
+                if len(lines) == batch_size:
+                    write_batch(lines)
+                    lines = []
+                    if written == num_lines:
+                        break
+        if len(lines) > 0 and written < num_lines:
+            write_batch(lines)
+
+        index += 1
+        if index % len(files) == 0 and written == 0:
+            raise ValueError(f"Part {part} does not have any lines, files are too small for {num_parts} parts.")
+
+    writer.close()
+
+    if isinstance(aspell_speller, aspell_cache.CachedSpeller):
+        print(aspell_speller.get_stats())
+    return written
+
+
+def create_error_data(files: List[str], output: str, num_lines: int, num_parallel: int, gel: GenereteErrorLine, lang: str = "cs",
+                      output_format: str = "tsv", tokenizer=None, max_length: int = None, batch_size: int = 1024,
+                      aspell_cache_size: int = 0, aspell_suggestions_file: str = None, seed: int = 42, shard_size: int = None,
+                      shard_store_text: bool = True, report_interval: float = 30.0) -> int:
+    # Main method of fast dataset creation, it runs num_parallel parts and reports lines/sec until they are finished.
+    rng = random.Random(seed)
+    file_starts = []
+    for file in files:
+        file_size = line_index.get_file_metadata(file, build_index=True)['num_lines']
+        file_starts.append(rng.randint(0, file_size - 1))
+
+    arguments = []
+    for part in range(num_parallel):
+        part_lines = num_lines // num_parallel + (1 if part < num_lines % num_parallel else 0)
+        arguments.append((part, num_parallel, files, file_starts, part_lines, output, output_format, gel, lang, tokenizer, max_length,
+                          batch_size, aspell_cache_size, aspell_suggestions_file, seed, shard_size, shard_store_text, ))
+
+    progress = Value('q', 0)
+    start = time.perf_counter()
+    with Pool(num_parallel, initializer=_init_progress, initargs=(progress, )) as pool:
+        result = pool.starmap_async(create_error_data_part, arguments)
+        while not result.ready():
+            result.wait(report_interval)
+            elapsed = time.perf_counter() - start
+            print(f"{progress.value}/{num_lines} lines, {progress.value / elapsed:.0f} lines/sec")
+        written = sum(result.get())
+
+    if output_format != "shards":
+        with open(output, 'ab') as output_file:
+            for part in range(num_parallel):
+                with open(get_part_path(output, part), 'rb') as part_file:
+                    shutil.copyfileobj(part_file, output_file, 16 * 1024 * 1024)
+                os.remove(get_part_path(output, part))
+
+    elapsed = time.perf_counter() - start
+    print(f"Done: {written} lines in {elapsed:.0f} s ({written / elapsed:.0f} lines/sec)")
+    return written
@@ -0,0 +1,145 @@
+import os
+import hashlib
+
+from typing import List
+from multiprocessing import Pool
+
+from m2scorer.levenshtein import batch_multi_pre_rec_f1_part
+
+###
+#
+# Parallel M2 scoring of predictions (replacement of sequential loop in evaluator.compute_metrics).
+#
+#   Predictions are scored in slices of slice_size sentences by batch_multi_pre_rec_f1_part (it is created
+#   by petr pechman in fork from M2scorer, it is almost same as batch_multi_pre_rec_f1,
+#   https://github.com/petrpechman/m2scorer/blob/cbf794b370be2fc77f98ee9531cf33001572b7ce/m2scorer/levenshtein.py#L866).
+#   Slices are scored by pool of processes and returned in order, so running precision, recall and f1
+#   are printed same as before.
+#
+#   Slice (not sentence) is the smallest unit of work: for every sentence batch_multi_pre_rec_f1_part chooses
+#   gold annotator that maximizes f1 of counts accumulated in the slice, so counts of sentence depend on
+#   previous sentences of its slice. Only same slices give exactly same results as the sequential loop.
+#   Counts (correct, proposed, gold) of every slice are kept in slice_stats.
+#
+#   Counts can be stored in persistent cache (cache_file), key is hash of sources, predictions and gold edits
+#   of slice (and scoring parameters). Cache is shared by all checkpoints and runs, so only slices
+#   with changed prediction are scored again. For the same reason as above, the cache works with slices,
+#   not with single sentences. Cache file is append-only text file with lines "key\tcorrect\tproposed\tgold".
+#
+###
+
+
+def get_prf(stat_correct: int, stat_proposed: int, stat_gold: int, beta: float):
+    p  = stat_correct / stat_proposed if stat_proposed > 0 else 0
+    r  = stat_correct / stat_gold if stat_gold > 0 else 0
+    f1 = (1.0+beta*beta) * p * r / (beta*beta*p+r) if (p+r) > 0 else 0
+    return p, r, f1
+
+
+def _score_slice(args):
+    predictions, sources, gold_edits, max_unchanged_words, beta, ignore_whitespace_casing, verbose, very_verbose = args
+    return batch_multi_pre_rec_f1_part(
+        predictions, sources, gold_edits,
+        max_unchanged_words, beta, ignore_whitespace_casing, verbose, very_verbose)
+
+
+class ScoreCache:
+    def __init__(self, cache_file: str):
+        self.cache_file = cache_file
+        self._stats = {}
+        if os.path.isfile(cache_file):
+            with open(cache_file) as reader:
+                for line in reader:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) == 4:
+                        # line can be incomplete if writing was interrupted
+                        self._stats[fields[0]] = tuple(int(field) for field in fields[1:])
+
+    def __len__(self) -> int:
+        return len(self._stats)
+
+    def get(self, key: str):
+        return self._stats.get(key, None)
+
+    def add(self, items):
+        # items are pairs (key, stats)
+        with open(self.cache_file, 'a') as writer:
+            for key, stats in items:
+                self._stats[key] = stats
+                writer.write(key + "\t" + "\t".join(str(stat) for stat in stats) + "\n")
+
+
+class M2Scorer:
+    def __init__(self, slice_size: int, max_unchanged_words: int, beta: float, ignore_whitespace_casing: bool,
+                 verbose: bool = False, very_verbose: bool = False, num_processes: int = 4, cache_file: str = None):
+        self.slice_size = slice_size
+        self.max_unchanged_words = max_unchanged_words
+        self.beta = beta
+        self.ignore_whitespace_casing = ignore_whitespace_casing
+        self.verbose = verbose
+        self.very_verbose = very_verbose
+        self.slice_stats = []
+        self.cache = ScoreCache(cache_file) if cache_file else None
+        self._pool = Pool(num_processes)
+
+    def _get_slice_arguments(self, predictions: List[str], sources: List[str], gold_edits: list, start: int):
+        end = start + self.slice_size
+        return (predictions[start:end], sources[start:end], gold_edits[start:end],
+                self.max_unchanged_words, self.beta, self.ignore_whitespace_casing, self.verbose, self.very_verbose)
+
+    def _get_slice_key(self, predictions: List[str], sources: List[str], gold_edits: list, start: int) -> str:
+        end = start + self.slice_size
+        content = repr((self.slice_size, self.max_unchanged_words, self.beta, self.ignore_whitespace_casing,
+                        predictions[start:end], sources[start:end], gold_edits[start:end]))
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def score(self, predictions: List[str], sources: List[str], gold_edits: list):
+        '''
+        Computes true positives (stat_correct), TP+FN (stat_gold), TP+FP (stat_proposed) for every slice in parallel
+        and prints running precision, recall and f1. Returns total counts.
+        '''
+        starts = range(0, len(predictions), self.slice_size)
+
+        # only slices that are not in cache are scored
+        keys, cached_stats = [], []
+        for start in starts:
+            key = self._get_slice_key(predictions, sources, gold_edits, start) if self.cache is not None else None
+            keys.append(key)
+            cached_stats.append(self.cache.get(key) if self.cache is not None else None)
+        arguments = (self._get_slice_arguments(predictions, sources, gold_edits, start) 
+                     for start, stats in zip(starts, cached_stats) if stats is None)
+        scored_stats = self._pool.imap(_score_slice, arguments)
+        if self.cache is not None:
+            print(f"Cached slices: {sum(stats is not None for stats in cached_stats)}/{len(cached_stats)}")
+
+        self.slice_stats = []
+        new_stats = []
+        total_stat_correct, total_stat_proposed, total_stat_gold = 0, 0, 0
+        for start, key, stats in zip(starts, keys, cached_stats):
+            if stats is None:
+                stats = tuple(next(scored_stats))
+                new_stats.append((key, stats))
+            stat_correct, stat_proposed, stat_gold = stats
+            self.slice_stats.append(stats)
+            total_stat_correct += stat_correct
+            total_stat_proposed += stat_proposed
+            total_stat_gold += stat_gold
+            p, r, f1 = get_prf(total_stat_correct, total_stat_proposed, total_stat_gold, self.beta)
+            print(f"Step {start+1}")
+            print("Precision:\t", p)
+            print("Recall:\t", r)
+            print("F1:\t", f1)
+
+        if self.cache is not None and len(new_stats) > 0:
+            self.cache.add(new_stats)
+        return total_stat_correct, total_stat_proposed, total_stat_gold
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
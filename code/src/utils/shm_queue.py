@@ -0,0 +1,154 @@
+import os
+import queue
+import weakref
+import numpy as np
+
+from multiprocessing import Lock, Semaphore, RawArray, RawValue
+from multiprocessing import shared_memory
+
+###
+#
+# Queue for training examples that replaces Manager().Queue between data_loader processes and tf.data.
+#
+#   Examples are not pickled and they do not go through proxy server process. Every example is copied
+#   into one fixed-size slot of shared memory:
+#     int32 header (lengths of input_ids, attention_mask, tokenized_target_line, original_sentence, correct_sentence),
+#     int32 token buffers (3 * max_length), UTF-8 bytes of original_sentence and correct_sentence (2 * max_sentence_bytes).
+#   Indices of free and filled slots are kept in two small rings in shared memory.
+#
+#   Locks and semaphores can be shared only through inheritance, so the queue has to be passed to processes
+#   as argument of Process or in initargs of Pool (see load_data.data_generator), not as argument of starmap.
+#
+#   Shared memory is released (closed and unlinked) by close() or at the latest at exit of the process that
+#   created the queue (weakref.finalize), other processes never unlink it.
+#
+###
+
+HEADER_LENGTH = 5
+
+
+def _release_shared_memory(shm: shared_memory.SharedMemory, creator_pid: int):
+    if os.getpid() != creator_pid:
+        return
+    try:
+        shm.close()
+    except BufferError:
+        # some view into shared memory still exists, memory is unmapped at exit anyway
+        pass
+    shm.unlink()
+
+
+class _SlotRing:
+    '''
+    Ring of slot indices, it never overflows because it holds at most all slots of queue.
+    '''
+    def __init__(self, capacity: int, items=()):
+        self._capacity = capacity
+        self._items = RawArray('i', capacity)
+        self._head = RawValue('i', 0)
+        self._tail = RawValue('i', 0)
+        self._lock = Lock()
+
+        items = list(items)
+        for i, item in enumerate(items):
+            self._items[i] = item
+        self._tail.value = len(items) % capacity
+        self._available = Semaphore(len(items))
+
+    def push(self, item: int):
+        with self._lock:
+            self._items[self._tail.value] = item
+            self._tail.value = (self._tail.value + 1) % self._capacity
+        self._available.release()
+
+    def pop(self, block: bool = True, timeout=None) -> int:
+        if not self._available.acquire(block, timeout):
+            raise queue.Empty
+        with self._lock:
+            item = self._items[self._head.value]
+            self._head.value = (self._head.value + 1) % self._capacity
+        return item
+
+
+class SharedMemoryQueue:
+    '''
+    Queue with same put/get interface as Manager().Queue for dicts created in load_data.data_loader.
+    '''
+    def __init__(self, num_slots: int, max_length: int, max_sentence_bytes: int = 4096):
+        self.num_slots = num_slots
+        self.max_length = max_length
+        self.max_sentence_bytes = max_sentence_bytes
+
+        self._num_ints = HEADER_LENGTH + 3 * max_length
+        self._ints_size = 4 * self._num_ints
+        self._slot_size = self._ints_size + 2 * max_sentence_bytes
+
+        self._shm = shared_memory.SharedMemory(create=True, size=num_slots * self._slot_size)
+        self._free = _SlotRing(num_slots, range(num_slots))
+        self._filled = _SlotRing(num_slots)
+        self._finalizer = weakref.finalize(self, _release_shared_memory, self._shm, os.getpid())
+
+    def __getstate__(self):
+        # finalizer stays in process that created the queue
+        state = self.__dict__.copy()
+        state['_finalizer'] = None
+        return state
+
+    def _get_slot(self, index: int):
+        start = index * self._slot_size
+        ints = np.ndarray((self._num_ints, ), dtype=np.int32, buffer=self._shm.buf, offset=start)
+        text = self._shm.buf[start + self._ints_size:start + self._slot_size]
+        return ints, text
+
+    def put(self, dato: dict, block: bool = True, timeout=None):
+        arrays = [dato["input_ids"], dato["attention_mask"], dato["tokenized_target_line"]]
+        original_sentence = dato["original_sentence"].encode('utf-8')
+        correct_sentence = dato["correct_sentence"].encode('utf-8')
+
+        if any(len(array) > self.max_length for array in arrays):
+            raise ValueError(f"Example is longer than max_length ({self.max_length}).")
+        if len(original_sentence) > self.max_sentence_bytes or len(correct_sentence) > self.max_sentence_bytes:
+            raise ValueError(f"Sentence is longer than max_sentence_bytes ({self.max_sentence_bytes}).")
+
+        index = self._free.pop(block, timeout)
+        ints, text = self._get_slot(index)
+
+        ints[:HEADER_LENGTH] = [len(arrays[0]), len(arrays[1]), len(arrays[2]), len(original_sentence), len(correct_sentence)]
+        position = HEADER_LENGTH
+        for array in arrays:
+            ints[position:position + len(array)] = array
+            position += len(array)
+        text[:len(original_sentence)] = original_sentence
+        text[self.max_sentence_bytes:self.max_sentence_bytes + len(correct_sentence)] = correct_sentence
+
+        self._filled.push(index)
+
+    def get(self, block: bool = True, timeout=None) -> dict:
+        index = self._filled.pop(block, timeout)
+        ints, text = self._get_slot(index)
+
+        input_ids_len, attention_mask_len, target_len, original_len, correct_len = ints[:HEADER_LENGTH].tolist()
+        position = HEADER_LENGTH
+        input_ids = ints[position:position + input_ids_len].copy()
+        position += input_ids_len
+        attention_mask = ints[position:position + attention_mask_len].copy()
+        position += attention_mask_len
+        tokenized_target_line = ints[position:position + target_len].copy()
+        original_sentence = bytes(text[:original_len]).decode('utf-8')
+        correct_sentence = bytes(text[self.max_sentence_bytes:self.max_sentence_bytes + correct_len]).decode('utf-8')
+
+        self._free.push(index)
+
+        dato = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "tokenized_target_line": tokenized_target_line,
+            "original_sentence": original_sentence,
+            "correct_sentence": correct_sentence,
+        }
+        return dato
+
+    def close(self):
+        # Releases shared memory, it does nothing in other processes than the one that created the queue.
+        if self._finalizer is not None:
+            self._finalizer()
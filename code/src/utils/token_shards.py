@@ -0,0 +1,210 @@
+import os
+import glob
+import json
+import numpy as np
+
+from typing import List
+
+###
+#
+# Pre-tokenized corpus stored in shards, it replaces reading and tokenizing of TSV files in every epoch.
+#
+#   Every shard "<name>" is a group of files in one directory:
+#     <name>.input_ids - flat int32 array with input_ids of all examples,
+#     <name>.labels    - flat int32 array with tokenized target lines of all examples,
+#     <name>.index     - uint64 array (num_examples + 1, 3) with start offsets of every example in input_ids,
+#                        labels and text (last row contains ends of the last example),
+#     <name>.tsv       - optional raw text, lines "correct_sentence\toriginal_sentence" (same format as files
+#                        for errors_from_file), so shard can be also used as ordinary TSV,
+#     <name>.json      - metadata (number of examples, tokenizer, ...), it is written as the last file,
+#                        so only shards with .json are complete.
+#   Attention mask is not stored, examples are tokenized without padding, so it is all ones.
+#   All arrays are memory-mapped, so reading of example is just slicing.
+#
+#   Order of examples is deterministic: shards are read by round robin (it is what tf.data interleave does),
+#   examples inside shard are shuffled by blocks of BLOCK_SIZE examples (permutation of blocks and permutation
+#   inside block), permutation depends on seed, epoch and shard. Reading can be resumed from any example
+#   (see get_resume_positions).
+#
+###
+
+INDEX_COLUMNS = 3 # input_ids, labels, text
+BLOCK_SIZE = 4096
+DEFAULT_SHARD_SIZE = 1_000_000
+
+
+class ShardWriter:
+    '''
+    Writes examples into shards of shard_size examples, shards are named "<prefix>-00000", "<prefix>-00001", ...
+    Every process has to use its own prefix.
+    '''
+    def __init__(self, directory: str, prefix: str = "shard", shard_size: int = DEFAULT_SHARD_SIZE, store_text: bool = True,
+                 metadata: dict = None, buffer_size: int = 8 * 1024 * 1024):
+        self.directory = directory
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.store_text = store_text
+        self.metadata = metadata if metadata is not None else {}
+        self.buffer_size = buffer_size
+        self.num_shards = 0
+        self.num_examples = 0
+        self._files = None
+
+        os.makedirs(directory, exist_ok=True)
+        # continue after shards that already exist (e.g. after restart of dataset creation)
+        while os.path.isfile(self._get_path(self.num_shards, '.json')):
+            self.num_shards += 1
+
+    def _get_path(self, shard: int, suffix: str) -> str:
+        return os.path.join(self.directory, f"{self.prefix}-{shard:05d}{suffix}")
+
+    def _open_shard(self):
+        suffixes = ['.input_ids', '.labels', '.index'] + (['.tsv'] if self.store_text else [])
+        self._files = {suffix: open(self._get_path(self.num_shards, suffix + '.tmp'), 'wb', buffering=self.buffer_size) for suffix in suffixes}
+        self._offsets = np.zeros(INDEX_COLUMNS, dtype=np.uint64)
+        self._shard_examples = 0
+        np.zeros(INDEX_COLUMNS, dtype=np.uint64).tofile(self._files['.index'])
+
+    def _close_shard(self):
+        for f in self._files.values():
+            f.close()
+        for suffix in self._files.keys():
+            os.replace(self._get_path(self.num_shards, suffix + '.tmp'), self._get_path(self.num_shards, suffix))
+
+        metadata = dict(self.metadata)
+        metadata["num_examples"] = self._shard_examples
+        metadata["store_text"] = self.store_text
+        with open(self._get_path(self.num_shards, '.json.tmp'), 'w') as json_file:
+            json.dump(metadata, json_file)
+        os.replace(self._get_path(self.num_shards, '.json.tmp'), self._get_path(self.num_shards, '.json'))
+
+        self._files = None
+        self.num_shards += 1
+
+    def write(self, input_ids, tokenized_target_line, original_sentence: str = "", correct_sentence: str = ""):
+        if self._files is None:
+            self._open_shard()
+
+        input_ids = np.asarray(input_ids, dtype=np.int32)
+        tokenized_target_line = np.asarray(tokenized_target_line, dtype=np.int32)
+        self._files['.input_ids'].write(input_ids.tobytes())
+        self._files['.labels'].write(tokenized_target_line.tobytes())
+        text_length = 0
+        if self.store_text:
+            text = (correct_sentence + "\t" + original_sentence + "\n").encode('utf-8')
+            self._files['.tsv'].write(text)
+            text_length = len(text)
+
+        self._offsets += np.array([len(input_ids), len(tokenized_target_line), text_length], dtype=np.uint64)
+        self._files['.index'].write(self._offsets.tobytes())
+        self._shard_examples += 1
+        self.num_examples += 1
+
+        if self._shard_examples == self.shard_size:
+            self._close_shard()
+
+    def close(self):
+        # Finishes the last (incomplete) shard.
+        if self._files is not None:
+            self._close_shard()
+
+
+class Shard:
+    '''
+    Read-only memory-mapped shard.
+    '''
+    def __init__(self, path: str):
+        # path is without suffix
+        self.path = path
+        with open(path + '.json') as json_file:
+            self.metadata = json.load(json_file)
+        self.num_examples = self.metadata["num_examples"]
+        self.store_text = self.metadata["store_text"]
+        self._input_ids = None
+        self._labels = None
+        self._index = None
+        self._text = None
+
+    def _open(self):
+        # mmap of empty file is not possible
+        self._index = np.memmap(self.path + '.index', dtype=np.uint64, mode='r').reshape(-1, INDEX_COLUMNS)
+        self._input_ids = np.memmap(self.path + '.input_ids', dtype=np.int32, mode='r') if self._index[-1, 0] > 0 else np.zeros(0, dtype=np.int32)
+        self._labels = np.memmap(self.path + '.labels', dtype=np.int32, mode='r') if self._index[-1, 1] > 0 else np.zeros(0, dtype=np.int32)
+        if self.store_text and self._index[-1, 2] > 0:
+            self._text = np.memmap(self.path + '.tsv', dtype=np.uint8, mode='r')
+
+    def __len__(self) -> int:
+        return self.num_examples
+
+    def get(self, i: int) -> dict:
+        if self._index is None:
+            self._open()
+        start, end = self._index[i], self._index[i + 1]
+        input_ids = np.array(self._input_ids[int(start[0]):int(end[0])])
+        tokenized_target_line = np.array(self._labels[int(start[1]):int(end[1])])
+        correct_sentence, original_sentence = "", ""
+        if self._text is not None:
+            line = self._text[int(start[2]):int(end[2])].tobytes().decode('utf-8')
+            correct_sentence, original_sentence = line[:-1].split('\t', 1)
+
+        dato = {
+            "input_ids": input_ids,
+            "attention_mask": np.ones_like(input_ids),
+            "tokenized_target_line": tokenized_target_line,
+            "original_sentence": original_sentence,
+            "correct_sentence": correct_sentence,
+        }
+        return dato
+
+
+def get_shard_paths(directory: str) -> List[str]:
+    # Returns sorted paths (without suffix) of all complete shards in directory.
+    return sorted(path[:-len('.json')] for path in glob.glob(os.path.join(directory, '*.json')))
+
+
+def get_shard_order(num_shards: int, seed: int) -> np.ndarray:
+    # Order in which shards are interleaved, it is same for all epochs.
+    return np.random.default_rng([seed, num_shards]).permutation(num_shards)
+
+
+def get_example_order(num_examples: int, seed: int, epoch: int, shard: int) -> np.ndarray:
+    # Permutation of examples inside shard: blocks are permuted and examples are permuted inside every block,
+    # so reading stays local in memory-mapped files.
+    rng = np.random.default_rng([seed, epoch, shard])
+    num_blocks = (num_examples + BLOCK_SIZE - 1) // BLOCK_SIZE
+    order = []
+    for block in rng.permutation(num_blocks):
+        start = block * BLOCK_SIZE
+        end = min(start + BLOCK_SIZE, num_examples)
+        order.append(start + rng.permutation(end - start))
+    return np.concatenate(order) if order else np.zeros(0, dtype=np.int64)
+
+
+def get_resume_positions(lengths: List[int], start_example: int):
+    '''
+    Examples of shards (with given lengths) are read by round robin, in every round one example from every shard
+    that is not exhausted. Returns number of already read examples of every shard after start_example examples
+    and index of shard (in lengths) that is read next. Round robin started from this shard gives same order
+    as the original one.
+    '''
+    lengths = np.asarray(lengths, dtype=np.int64)
+    start_example = start_example % max(int(lengths.sum()), 1)
+
+    # find the round, in which start_example-th example is read
+    read = 0
+    rounds = 0
+    for length in np.unique(lengths):
+        active = int((lengths > rounds).sum())
+        if read + (length - rounds) * active > start_example:
+            break
+        read += (length - rounds) * active
+        rounds = length
+    active_shards = np.flatnonzero(lengths > rounds)
+    full_rounds = rounds + (start_example - read) // len(active_shards)
+    rest = (start_example - read) % len(active_shards)
+
+    positions = np.minimum(lengths, full_rounds)
+    active_shards = np.flatnonzero(lengths > full_rounds)
+    positions[active_shards[:rest]] += 1
+    next_shard = int(active_shards[rest])
+    return positions, next_shard
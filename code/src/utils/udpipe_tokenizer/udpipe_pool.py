@@ -0,0 +1,63 @@
+from typing import List
+from multiprocessing import Pool
+
+from .udpipe_tokenizer import UDPipeTokenizer
+
+###
+#
+# UDPipe tokenization of many sentences by pool of processes.
+#
+#   Every process loads UDPipe model once (in initializer) and tokenizes whole batches of lines
+#   by UDPipeTokenizer.tokenize_batch (one reused native tokenizer).
+#   Batches are returned in original order, so tokenized lines can be consumed while other batches
+#   are still tokenized (imap).
+#   Tokenized line is string of tokens joined by space, if first_sentence_only is set, only the first
+#   sentence found by UDPipe is used (it is what evaluator_params and eval_backup do),
+#   otherwise tokens of all sentences are joined.
+#
+#   Pool should be created before TensorFlow initializes GPUs, processes are forked.
+#
+###
+
+_udpipe_tokenizer = None
+
+
+def _init_tokenizer(lang: str):
+    global _udpipe_tokenizer
+    _udpipe_tokenizer = UDPipeTokenizer(lang)
+
+
+def _tokenize_batch(batch) -> List[str]:
+    lines, first_sentence_only = batch
+    return _udpipe_tokenizer.tokenize_batch(lines, first_sentence_only)
+
+
+class UDPipeTokenizerPool:
+    def __init__(self, lang: str, num_processes: int = 4, batch_size: int = 256, first_sentence_only: bool = False):
+        self.lang = lang
+        self.batch_size = batch_size
+        self.first_sentence_only = first_sentence_only
+        self._pool = Pool(num_processes, initializer=_init_tokenizer, initargs=(lang, ))
+
+    def imap(self, lines: List[str]):
+        # Yields tokenized batches (lists of lines) in order.
+        batches = ((lines[i:i+self.batch_size], self.first_sentence_only) for i in range(0, len(lines), self.batch_size))
+        return self._pool.imap(_tokenize_batch, batches)
+
+    def tokenize(self, lines: List[str], verbose: bool = True) -> List[str]:
+        tokenized_lines = []
+        for tokenized_batch in self.imap(lines):
+            tokenized_lines.extend(tokenized_batch)
+            if verbose:
+                print(f"Tokenize {len(tokenized_lines)} sentences.")
+        return tokenized_lines
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
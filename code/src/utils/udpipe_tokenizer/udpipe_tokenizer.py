@@ -20,6 +20,8 @@ class UDPipeTokenizer:
     }
 
     class Token:
+        __slots__ = ("string", "start", "end")
+
         def __init__(self, string, start, end):
             self.string = string
             self.start = start
@@ -30,13 +32,39 @@ class UDPipeTokenizer:
             self._model = ufal.udpipe.Model.load(self.MODELS_NO_PATHS[lang])
         else:
             self._model = ufal.udpipe.Model.load(self.MODELS[lang])
+        # native tokenizer, sentence and error reused by tokenize_batch
+        self._tokenizer = None
+        self._sentence = ufal.udpipe.Sentence()
+        self._error = ufal.udpipe.ProcessingError()
 
-    def tokenize(self, text):
-        """ Return tokenized text as a list of sentences, each a list of tokens. """
-
+    def _new_tokenizer(self):
         tokenizer = self._model.newTokenizer(self._model.TOKENIZER_RANGES)
         if not tokenizer:
             raise RuntimeError("The model does not have a tokenizer")
+        return tokenizer
+
+    @staticmethod
+    def _sentence_tokens(sentence):
+        """ Yield tokens of sentence, multiword token is yielded instead of its words. """
+
+        multiword_tokens = sentence.multiwordTokens
+        multiword_token = 0
+        for word in sentence.words[1:]:
+            while multiword_token < len(multiword_tokens) and \
+                    word.id > multiword_tokens[multiword_token].idLast:
+                multiword_token += 1
+            if multiword_token < len(multiword_tokens) and \
+                    word.id >= multiword_tokens[multiword_token].idFirst and \
+                    word.id <= multiword_tokens[multiword_token].idLast:
+                if word.id > multiword_tokens[multiword_token].idFirst:
+                    continue
+                word = multiword_tokens[multiword_token]
+            yield word
+
+    def tokenize(self, text):
+        """ Return tokenized text as a list of sentences, each a list of tokens. """
+
+        tokenizer = self._new_tokenizer()
 
         tokenizer.setText(text)
         error = ufal.udpipe.ProcessingError()
@@ -44,26 +72,35 @@ class UDPipeTokenizer:
 
         sentence = ufal.udpipe.Sentence()
         while tokenizer.nextSentence(sentence, error):
-            sentences.append([])
-
-            multiword_token = 0
-            for word in sentence.words[1:]:
-                while multiword_token < len(sentence.multiwordTokens) and \
-                        word.id > sentence.multiwordTokens[multiword_token].idLast:
-                    multiword_token += 1
-                if multiword_token < len(sentence.multiwordTokens) and \
-                        word.id >= sentence.multiwordTokens[multiword_token].idFirst and \
-                        word.id <= sentence.multiwordTokens[multiword_token].idLast:
-                    if word.id > sentence.multiwordTokens[multiword_token].idFirst:
-                        continue
-                    word = sentence.multiwordTokens[multiword_token]
-                sentences[-1].append(self.Token(word.form, word.getTokenRangeStart(), word.getTokenRangeEnd()))
+            sentences.append([self.Token(word.form, word.getTokenRangeStart(), word.getTokenRangeEnd())
+                              for word in self._sentence_tokens(sentence)])
 
         if error.occurred():
             raise RuntimeError(error.message)
 
         return sentences
 
+    def tokenize_batch(self, lines, first_sentence_only: bool = False):
+        """ Return every line tokenized as one string of tokens joined by space (only the first sentence if first_sentence_only). """
+
+        if self._tokenizer is None:
+            self._tokenizer = self._new_tokenizer()
+        tokenizer, sentence, error = self._tokenizer, self._sentence, self._error
+
+        tokenized_lines = []
+        for line in lines:
+            tokenizer.setText(line)
+            forms = []
+            while tokenizer.nextSentence(sentence, error):
+                forms.extend(word.form for word in self._sentence_tokens(sentence))
+                if first_sentence_only:
+                    break
+            if error.occurred():
+                raise RuntimeError(error.message)
+            tokenized_lines.append(" ".join(forms))
+
+        return tokenized_lines
+
 if __name__ == "__main__":
     import argparse
     import fileinput
@@ -0,0 +1,83 @@
+import numpy as np
+import tensorflow as tf
+
+from typing import List
+
+###
+#
+# Generation by XLA-compiled model.generate with static shapes.
+#
+#   Every batch is padded to the smallest length bucket that is not shorter than the batch, number of rows
+#   is padded to the power of two (padding rows contain only one pad token with attention mask 1).
+#   Compiled function is created for every bucket and it is cached, so compilation happens only once
+#   per (bucket, number of rows).
+#   Max length of generated sentence is max_length (same as eager generation); optionally it can be limited by bucket:
+#   min(max_length, max_length_factor * bucket + max_length_offset), it is faster, but longer outputs are truncated.
+#   Batches longer than the last bucket are generated eagerly with max_length.
+#
+###
+
+DEFAULT_BUCKETS = [16, 32, 64, 128, 256, 512]
+
+
+def get_bucket(length: int, buckets: List[int]):
+    for bucket in buckets:
+        if length <= bucket:
+            return bucket
+    return None
+
+
+def get_num_rows(batch_size: int) -> int:
+    num_rows = 1
+    while num_rows < batch_size:
+        num_rows *= 2
+    return num_rows
+
+
+class BucketedGenerator:
+    def __init__(self, model, pad_token_id: int, max_length: int, buckets: List[int] = None,
+                 max_length_factor: float = None, max_length_offset: int = 16, **generate_kwargs):
+        self.model = model
+        self.pad_token_id = pad_token_id
+        self.max_length = max_length
+        self.buckets = sorted(buckets if buckets else DEFAULT_BUCKETS)
+        self.max_length_factor = max_length_factor
+        self.max_length_offset = max_length_offset
+        self.generate_kwargs = generate_kwargs
+        self._functions = {}
+
+    def get_max_length(self, bucket: int) -> int:
+        if self.max_length_factor is None:
+            return self.max_length
+        return min(self.max_length, int(self.max_length_factor * bucket) + self.max_length_offset)
+
+    def _get_function(self, bucket: int):
+        if bucket not in self._functions:
+            max_length = self.get_max_length(bucket)
+
+            def generate(input_ids, attention_mask):
+                return self.model.generate(input_ids, attention_mask=attention_mask, max_length=max_length, **self.generate_kwargs)
+
+            self._functions[bucket] = tf.function(generate, jit_compile=True)
+        return self._functions[bucket]
+
+    def generate(self, input_ids, attention_mask):
+        input_ids = np.asarray(input_ids)
+        attention_mask = np.asarray(attention_mask)
+        batch_size = input_ids.shape[0]
+        # trailing padding of the whole batch is not needed
+        length = max(int(attention_mask.sum(axis=1).max()), 1)
+
+        bucket = get_bucket(length, self.buckets)
+        if bucket is None:
+            return self.model.generate(input_ids, attention_mask=attention_mask, max_length=self.max_length, **self.generate_kwargs)
+
+        num_rows = get_num_rows(batch_size)
+        padded_input_ids = np.full((num_rows, bucket), self.pad_token_id, dtype=np.int32)
+        padded_attention_mask = np.zeros((num_rows, bucket), dtype=np.int32)
+        padded_input_ids[:batch_size, :length] = input_ids[:, :length]
+        padded_attention_mask[:batch_size, :length] = attention_mask[:, :length]
+        padded_attention_mask[batch_size:, 0] = 1
+
+        preds = self._get_function(bucket)(tf.constant(padded_input_ids), tf.constant(padded_attention_mask))
+        return preds[:batch_size]